@@ -1,10 +1,31 @@
+import os
+import warnings
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import yfinance as yf
 
 from datetime import datetime, timedelta
-from datapipeline import historical_data, price
-from largecapindex import process_csv
+from datapipeline import historical_data, historical_snapshots, price_panel, date_window, metrics
+from largecapindex import mcap_weighted_returns
+from cache import cached, canonical
+from outliers import remove_outliers
+from profiling import profiled, period, stage
+from schedule import is_calendar, calendar_schedule, ranking_changes
+
+# (name, label prefix) of the common N-tiles; any other count is 'Bucket 1' .. 'Bucket N'
+bucket_names = {3: ('Tercile', 'T'), 4: ('Quartile', 'QR'), 5: ('Quintile', 'Q'), 10: ('Decile', 'D'),
+                20: ('Ventile', 'V')}
+
+def portfolio_labels(buckets=5, long_short=False, verbose=False):
+    # labels in portfolio order: <= 0, the N-tiles from lowest to highest, then top minus bottom
+    name, prefix = bucket_names.get(buckets, ('Bucket', 'B'))
+    if verbose:
+        labels = ['Less than or equal to 0'] + [f'{name} {i}' for i in range(1, buckets + 1)]
+        spread = f'{name} {buckets} minus {name} 1'
+    else:
+        labels = ['<=0'] + [f'{prefix}{i}' for i in range(1, buckets + 1)]
+        spread = f'{prefix}{buckets}-{prefix}1'
+    return labels + [spread] if long_short else labels
+
 #------------------[rank_by]-----------------#
 #                                            #
 #     ranks index constituents by a given    #
@@ -13,31 +34,100 @@ from largecapindex import process_csv
 #                                            #
 #--------------------------------------------#
 
-def rank_by(given_date, index, metric, **kwargs):
+# column holding the blended score when metric is a {metric: weight} dict
+score_column = 'score'
+
+def metric_column(metric):
+    return score_column if isinstance(metric, dict) else metric
+
+@profiled
+def composite_score(snapshot, weights, normalize='zscore'):
+    # weighted sum of each metric normalised across the snapshot; NaN where any component is missing
+    values = snapshot[list(weights)].to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+
+    if normalize == 'zscore':
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean, std = np.nanmean(values, axis=0), np.nanstd(values, axis=0, ddof=1)
+        # a metric with no spread contributes nothing rather than blanking the score
+        normalized = np.where(valid, (values - mean) / np.where(std > 0, std, 1), np.nan)
+    elif normalize == 'rank':
+        # average rank of each value scaled to [-0.5, 0.5], ties share their mean rank
+        normalized = np.full(values.shape, np.nan)
+        for j in range(values.shape[1]):
+            _, inverse, counts = np.unique(values[valid[:, j], j], return_inverse=True, return_counts=True)
+            ranks = np.cumsum(counts) - (counts + 1) / 2
+            normalized[valid[:, j], j] = ranks[inverse] / (count[j] - 1) - 0.5 if count[j] > 1 else 0
+    else:
+        raise ValueError("Invalid normalization. Choose 'zscore' or 'rank'.")
+
+    return normalized @ np.fromiter(weights.values(), dtype=float, count=len(weights))
+
+@profiled
+def quintile_labels(snapshot, metric_list, split_nonpositive=True, buckets=5):
+    # ticker x metric labels: -1 missing, 0 for <= 0, 1-N for N-tiles (quintiles by default) of the positive
+    # values; without split_nonpositive every non-missing value is in an N-tile and the <= 0 bucket stays empty
+    if buckets < 1:
+        raise ValueError("buckets must be at least 1.")
+    values = snapshot[list(metric_list)].to_numpy(dtype=float)
+    positive = np.where(values > 0, values, np.nan) if split_nonpositive else values
+
+    # N-tile edges of every column at once, binned like pd.qcut (right-closed)
+    edges = np.full((buckets + 1, values.shape[1]), np.nan)
+    if len(values):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            edges = np.nanquantile(positive, np.linspace(0, 1, buckets + 1), axis=0)
+    quintiles = (positive[:, :, None] > edges[1:-1].T[None, :, :]).sum(axis=2) + 1
+
+    labels = np.where(np.isnan(positive), -1, quintiles)
+    if split_nonpositive:
+        labels = np.where(values <= 0, 0, labels)
+    labels = labels.astype(np.int8)
+    return pd.DataFrame(labels, index=snapshot['TICKER'].values, columns=list(metric_list))
+
+@profiled
+@cached
+def rank_by(given_date, index, metric, outliers=None, normalize='zscore', buckets=5, **kwargs):
     df = historical_data(given_date, index)
-    metrics = ['CAPEI', 'bm', 'evm', 'pe_op_basic', 'pe_op_dil', 'pe_exi', 'pe_inc', 'ps', 'pcf', 'dpr', 'npm',
-               'opmbd', 'opmad', 'gpm', 'ptpm', 'cfm', 'roa', 'roe', 'roce', 'efftax', 'aftret_eq', 'aftret_invcapx',
-               'aftret_equity', 'pretret_noa', 'pretret_earnat', 'GProf', 'equity_invcap', 'debt_invcap',
-               'totdebt_invcap', 'capital_ratio', 'int_debt', 'int_totdebt', 'cash_lt', 'invt_act', 'rect_act',
-               'debt_at', 'debt_ebitda', 'short_debt', 'curr_debt', 'lt_debt', 'profit_lct', 'ocf_lct', 'cash_debt',
-               'fcf_ocf', 'lt_ppent', 'dltt_be', 'debt_assets', 'debt_capital', 'de_ratio', 'intcov', 'intcov_ratio',
-               'cash_ratio', 'quick_ratio', 'curr_ratio', 'cash_conversion', 'inv_turn', 'at_turn', 'rect_turn',
-               'pay_turn', 'sale_invcap', 'sale_equity', 'sale_nwc', 'rd_sale', 'adv_sale', 'staff_sale', 'accrual',
-               'ptb', 'PEG_trailing', 'divyield']
-
-    assert metric in metrics, f"Invalid metric. Choose one of: {', '.join(metrics)}"
-    assert metric in df.columns, f"Metric '{metric}' not found in the dataframe columns."
-
-    df = df.sort_values(by=metric).reset_index(drop=True)
-    less_equal_zero = df[df[metric] <= 0]
-    quintiles = pd.qcut(df[df[metric] > 0][metric], 5, labels=False)
+    return rank_snapshot(df, metric, outliers, normalize, buckets)
+
+def rank_snapshot(df, metric, outliers=None, normalize='zscore', buckets=5):
+    # (<= 0 portfolio, [Q1..QN]) from a fundamentals snapshot
+    df, offsets = bucket_snapshot(df, metric, outliers, normalize, buckets)
+    less_equal_zero = df.iloc[offsets[0]:offsets[1]]
 
     quintile_groups = []
-    for i in range(5):
-        quintile_groups.append(df[df[metric] > 0][quintiles == i])
+    for i in range(buckets):
+        quintile_groups.append(df.iloc[offsets[i + 1]:offsets[i + 2]])
 
     return less_equal_zero, quintile_groups
 
+def bucket_snapshot(df, metric, outliers=None, normalize='zscore', buckets=5):
+    # (snapshot sorted by the metric, bucket offsets): portfolio i is df.iloc[offsets[i]:offsets[i + 1]],
+    # 0 holding <= 0 and 1-N the N-tiles; a {metric: weight} dict ranks on the composite score of its
+    # metrics, which has no <= 0 portfolio
+    components = list(metric) if isinstance(metric, dict) else [metric]
+    for component in components:
+        assert component in metrics, f"Invalid metric. Choose one of: {', '.join(metrics)}"
+        assert component in df.columns, f"Metric '{component}' not found in the dataframe columns."
+    if outliers is not None:
+        df = remove_outliers(df, method=outliers, columns=components)
+
+    column = metric_column(metric)
+    if isinstance(metric, dict):
+        df = df.assign(**{column: composite_score(df, metric, normalize)})
+
+    df = df.sort_values(by=column).reset_index(drop=True)
+    labels = quintile_labels(df, [column], split_nonpositive=not isinstance(metric, dict),
+                             buckets=buckets)[column].to_numpy()
+
+    # sorted by the metric, each bucket is a contiguous block: <= 0, Q1 .. QN, then missing values
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels[labels >= 0], minlength=buckets + 1))])
+    return df, offsets
+
 #---------------[year_backtest]--------------#
 #                                            #
 #  uses rank_by and CRSP data to calculate   #
@@ -46,92 +136,149 @@ def rank_by(given_date, index, metric, **kwargs):
 #                                            #
 #--------------------------------------------#
 
-def backtest(metric, start_date, index, frequency='yearly'):
-    # Rank portfolios based on the given metric
-    less_equal_zero, quintiles = rank_by(start_date, index, metric)
-    portfolios = [less_equal_zero] + quintiles
-    portfolio_tickers = [portfolio['TICKER'].tolist() for portfolio in portfolios]
-
-    # Convert start_date to datetime and set the end_date based on the frequency
-    start_date = pd.to_datetime(start_date)
+def period_end(start_date, frequency):
     if frequency == 'monthly':
-        end_date = start_date + pd.DateOffset(months=1)
+        return start_date + pd.DateOffset(months=1)
     elif frequency == 'quarterly':
-        end_date = start_date + pd.DateOffset(months=3)
+        return start_date + pd.DateOffset(months=3)
     elif frequency == 'yearly':
-        end_date = start_date + timedelta(days=365)
+        return start_date + timedelta(days=365)
     else:
-        raise ValueError("Invalid frequency. Choose from 'monthly', 'quarterly', or 'yearly'.")
+        raise ValueError("Invalid frequency. Choose 'monthly', 'quarterly', 'yearly', 'daily', 'weekly', "
+                         "'month_end', 'quarter_end', every N trading days, or a list of dates.")
+
+@profiled
+def return_matrix(index, start_date, end_date):
+    # daily returns of every ticker in the index over [start_date, end_date]
+    dates, tickers, values = price_panel(index)
+    lo, hi = date_window(dates, start_date, end_date)
+    price_matrix = np.asarray(values[lo:hi], dtype=float)
+
+    # carry the last price across missing days between a ticker's first & last price, so the move over a
+    # gap lands on the day trading resumes; names that stop trading are not filled and drop out
+    valid = ~np.isnan(price_matrix)
+    rows = np.arange(len(price_matrix))[:, None]
+    last_seen = np.maximum.accumulate(np.where(valid, rows, 0), axis=0)
+    last_valid = len(price_matrix) - 1 - np.argmax(valid[::-1], axis=0)
+    price_matrix = np.where(rows <= last_valid, np.take_along_axis(price_matrix, last_seen, axis=0), np.nan)
+
+    returns = np.full(price_matrix.shape, np.nan)
+    returns[1:] = price_matrix[1:] / price_matrix[:-1] - 1
+    return dates[lo:hi], tickers, price_matrix, returns
+
+@profiled
+def equal_weight_returns(matrix, portfolio_tickers, start_date, end_date, spreads=()):
+    # daily returns of each portfolio, then of each (long, short) pair in spreads as long minus short
+    daily_returns_list = bucket_returns(matrix, portfolio_tickers, start_date, end_date, spreads)
+    return [pd.DataFrame({'Date': pd.DatetimeIndex(period_dates), 'Return': period_returns})
+            for period_dates, period_returns in daily_returns_list]
+
+@profiled
+def bucket_returns(matrix, portfolio_tickers, start_date, end_date, spreads=()):
+    # equal_weight_returns as (dates, returns) arrays
+    dates, tickers, price_matrix, returns = matrix
+    lo, hi = date_window(dates, start_date, end_date)
+
+    # ticker x portfolio assignment matrix over the columns that have prices, filled from one
+    # (ticker, portfolio) array rather than portfolio by portfolio
+    held = np.concatenate([np.asarray(t, dtype=object) for t in portfolio_tickers])
+    bucket = np.repeat(np.arange(len(portfolio_tickers)), [len(t) for t in portfolio_tickers])
+    members = pd.Index(pd.unique(held))
+    cols = tickers.get_indexer(members)
+    rows = (cols >= 0)[members.get_indexer(held)]
+    members, cols = members[cols >= 0], cols[cols >= 0]
+    assignment = np.zeros((len(members), len(portfolio_tickers)))
+    assignment[members.get_indexer(held[rows]), bucket[rows]] = 1
+
+    # returns are measured within the period, so the first day has none
+    period_returns = returns[lo:hi][:, cols]
+    period_returns[:1] = np.nan
+    valid = ~np.isnan(period_returns)
+    traded = (~np.isnan(price_matrix[lo:hi][:, cols])) @ assignment > 0
+    total = np.where(valid, period_returns, 0) @ assignment
+    count = valid @ assignment
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_returns = np.where(count > 0, total / count, np.nan)
 
     daily_returns_list = []
+    for i in range(len(portfolio_tickers)):
+        rows = traded[:, i]
+        daily_returns_list.append((dates[lo:hi][rows], mean_returns[rows, i]))
+    for long, short in spreads:
+        rows = traded[:, long] & traded[:, short]
+        daily_returns_list.append((dates[lo:hi][rows], mean_returns[rows, long] - mean_returns[rows, short]))
+    return daily_returns_list
+
+@profiled
+@cached(ignore=('matrix',))
+def backtest(metric, start_date, index, frequency='yearly', matrix=None, buckets=5, long_short=False, **kwargs):
+    # Rank portfolios based on the given metric
+    less_equal_zero, quintiles = rank_by(start_date, index, metric, buckets=buckets, **kwargs)
+    portfolios = [less_equal_zero] + quintiles
+    portfolio_tickers = [portfolio['TICKER'].tolist() for portfolio in portfolios]
 
-    for tickers in portfolio_tickers:
-        if not tickers:
-            daily_returns_list.append(pd.DataFrame(columns=['Date', 'Return']))
-            continue
-
-        price_data = pd.DataFrame()
-
-        for ticker in tickers:
-            ticker_data = price(ticker, start_date, end_date, index)
-            if ticker_data is not None:
-                price_data[ticker] = ticker_data['prccd']
-
-        if not price_data.empty:
-            daily_returns = price_data.pct_change().mean(axis=1)
-            daily_returns_df = daily_returns.reset_index()
-            daily_returns_df.columns = ['Date', 'Return']
-            daily_returns_list.append(daily_returns_df)
-        else:
-            daily_returns_list.append(pd.DataFrame(columns=['Date', 'Return']))
+    # Convert start_date to datetime and set the end_date based on the frequency
+    start_date = pd.to_datetime(start_date)
+    end_date = period_end(start_date, frequency)
+    if matrix is None:
+        matrix = return_matrix(index, start_date, end_date)
 
+    daily_returns_list = equal_weight_returns(matrix, portfolio_tickers, start_date, end_date,
+                                              spreads=[(buckets, 1)] if long_short else [])
     return daily_returns_list, portfolios
 
-def mcap_backtest(metric, start_date, index='sp500'):
-    less_equal_zero, quintiles = rank_by(start_date, index, metric)
+#-------------------[screen]-----------------#
+#                                            #
+#   period returns of the quintiles of many  #
+#   metrics from one snapshot & label matrix #
+#                                            #
+#--------------------------------------------#
+
+@profiled
+def screen(given_date, index, metric_list=metrics, frequency='yearly', matrix=None, outliers=None, buckets=5,
+           long_short=False):
+    snapshot = historical_data(given_date, index)
+    if outliers is not None:
+        # metrics are bucketed independently, so mask outliers instead of dropping whole rows
+        snapshot = remove_outliers(snapshot, method='mask' if outliers == 'filter' else outliers, columns=metric_list)
+    labels = quintile_labels(snapshot, metric_list, buckets=buckets)
+    tickers, codes = labels.index.to_numpy(), labels.to_numpy()
+    portfolio_tickers = [tickers[codes[:, j] == k].tolist() for j in range(len(metric_list))
+                         for k in range(buckets + 1)]
+    spreads = [(j * (buckets + 1) + buckets, j * (buckets + 1) + 1) for j in range(len(metric_list))]
+
+    start_date = pd.to_datetime(given_date)
+    end_date = period_end(start_date, frequency)
+    if matrix is None:
+        matrix = return_matrix(index, start_date, end_date)
+
+    daily_returns_list = equal_weight_returns(matrix, portfolio_tickers, start_date, end_date,
+                                              spreads=spreads if long_short else [])
+    period_returns = [np.nan if daily_returns.empty else (1 + daily_returns['Return']).prod() - 1
+                      for daily_returns in daily_returns_list]
+    table = pd.DataFrame(np.reshape(period_returns[:len(portfolio_tickers)], (len(metric_list), buckets + 1)),
+                         index=list(metric_list), columns=portfolio_labels(buckets))
+    if long_short:
+        table[portfolio_labels(buckets, long_short)[-1]] = period_returns[len(portfolio_tickers):]
+    return table
+
+@profiled
+@cached
+def mcap_backtest(metric, start_date, index='sp500', buckets=5, long_short=False, **kwargs):
+    less_equal_zero, quintiles = rank_by(start_date, index, metric, buckets=buckets, **kwargs)
     portfolios = [less_equal_zero] + quintiles
     portfolio_tickers = [portfolio['TICKER'].tolist() for portfolio in portfolios]
 
-    df = process_csv()
-
     start_date = pd.to_datetime(start_date)
     date_range = pd.period_range(start=start_date, periods=1, freq='M')
-    portfolio_dfs = []
+    portfolio_returns = mcap_weighted_returns(portfolio_tickers, date_range)
+    if long_short:
+        spread = portfolio_returns[:, buckets] - portfolio_returns[:, 1]
+        portfolio_returns = np.column_stack([portfolio_returns, spread])
 
-    for portfolio in portfolio_tickers:
-
-        mkt_cap = pd.DataFrame(index=date_range)
-        mth_return = pd.DataFrame(index=date_range)
-        mcap_weights = pd.DataFrame(index=date_range)
-        mcap_weighted_return = pd.DataFrame(index=date_range)
-
-        for date in date_range:
-            tickers = portfolio
-            df_filtered = df[df['date'] == date]
-
-            for ticker in tickers:
-                ticker_data = df_filtered[df_filtered['Ticker'] == ticker]
-                if not ticker_data.empty:
-                    mkt_cap.at[date, ticker] = ticker_data['MthCap'].values[0]
-                    mth_return.at[date, ticker] = ticker_data['MthRetx'].values[0]
-
-            if date in mkt_cap.index:
-                total_market_cap = mkt_cap.loc[date].sum()
-                if total_market_cap != 0:
-                    for ticker in tickers:
-                        if ticker in mkt_cap.columns:
-                            mcap_weights.at[date, ticker] = mkt_cap.at[date, ticker] / total_market_cap
-
-            if date in mcap_weights.index:
-                row_sum = mcap_weights.loc[date].sum()
-                if row_sum != 0:
-                    mcap_weights.loc[date, 'SumOfWeights'] = row_sum
-                    mcap_weights.loc[date] = mcap_weights.loc[date] / row_sum
-
-        mcap_weighted_return = mth_return * mcap_weights
-        portfolio_return = mcap_weighted_return.sum(axis=1)
-        portfolio_df = pd.DataFrame({'Date': pd.to_datetime(date_range.astype(str)), 'Return': portfolio_return})
-        portfolio_dfs.append(portfolio_df)
+    portfolio_dfs = []
+    for i in range(portfolio_returns.shape[1]):
+        portfolio_dfs.append(pd.DataFrame({'Date': date_range.start_time, 'Return': portfolio_returns[:, i]}))
 
     return portfolio_dfs, portfolios
 
@@ -143,44 +290,205 @@ def mcap_backtest(metric, start_date, index='sp500'):
 #                                            #
 #--------------------------------------------#
 
-def rebalanced_portfolio(metric, index, start_date='2000-06-30', end_date='2023-12-31', frequency='yearly', mcap=False):
-    if mcap:
-        frequency = 'monthly'
+def rebalance_dates(start_date, end_date, frequency='yearly'):
     current_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
-
-    cumulative_portfolios = [pd.DataFrame(columns=['Date', 'Return']) for _ in range(6)]
-    portfolio_stats = {i: [] for i in range(6)}
-
+    dates = []
     while current_date < end_date:
-        if mcap:
-            returns, portfolios = mcap_backtest(metric, current_date.strftime('%Y-%m-%d'), index)
-        else:
-            returns, portfolios = backtest(metric, current_date.strftime('%Y-%m-%d'), index)
-
-        for i in range(6):
-            cumulative_portfolios[i] = pd.concat([cumulative_portfolios[i], returns[i]]).reset_index(drop=True)
-            if not portfolios[i].empty:
-                stats = {
-                    'Year': current_date.year,
-                    'Month': current_date.month,
-                    'Tickers': portfolios[i]['TICKER'].tolist(),
-                    'Min': round(portfolios[i][metric].min(), 2),
-                    'Max': round(portfolios[i][metric].max(), 2),
-                    'Mean': round(portfolios[i][metric].mean(), 3),
-                    'Std': round(portfolios[i][metric].std(), 3),
-                    'Period Return': round(((1 + returns[i]['Return']).prod() - 1), 5)
-                }
-                portfolio_stats[i].append(stats)
-
-        if frequency == 'monthly':
-            current_date += pd.DateOffset(months=1)
-        elif frequency == 'quarterly':
-            current_date += pd.DateOffset(months=3)
-        else:
-            current_date += timedelta(days=365)
-
-    for portfolio in cumulative_portfolios:
-        portfolio['Return'].fillna(0, inplace=True)
+        dates.append(current_date)
+        current_date = period_end(current_date, frequency)
+    return dates
+
+def rebalance_schedule(start_date, end_date, frequency, index):
+    # (rebalance dates, period ends) for a legacy frequency or a trading day calendar
+    if is_calendar(frequency):
+        return calendar_schedule(start_date, end_date, frequency, index)
+    dates = rebalance_dates(start_date, end_date, frequency)
+    return dates, [period_end(date, frequency) for date in dates]
+
+def compounded(returns):
+    return np.prod(1 + returns[~np.isnan(returns)]) - 1
+
+def period_stats_rows(tickers, values, offsets, current_date, returns, long_short=False):
+    # stats of every non-empty portfolio from the sorted tickers & metric values and the bucket offsets,
+    # then of top minus bottom when both legs hold stocks; returns are the daily return arrays
+    period_stats = {}
+    buckets = len(offsets) - 2
+    for i in range(buckets + 1):
+        lo, hi = offsets[i], offsets[i + 1]
+        if hi > lo:
+            period_stats[i] = {
+                'Year': current_date.year,
+                'Month': current_date.month,
+                'Tickers': tickers[lo:hi].tolist(),
+                'Min': round(values[lo:hi].min(), 2),
+                'Max': round(values[lo:hi].max(), 2),
+                'Mean': round(values[lo:hi].mean(), 3),
+                'Std': round(values[lo:hi].std(ddof=1), 3) if hi - lo > 1 else np.nan,
+                'Period Return': round(compounded(returns[i]), 5)
+            }
+    if long_short and buckets in period_stats and 1 in period_stats:
+        # Mean is the spread in the metric between the two legs; Min, Max & Std have no meaning for a spread
+        long, short = values[offsets[buckets]:offsets[buckets + 1]], values[offsets[1]:offsets[2]]
+        period_stats[buckets + 1] = dict(period_stats[buckets], Min=np.nan, Max=np.nan, Std=np.nan,
+                                         Tickers=period_stats[buckets]['Tickers'] + period_stats[1]['Tickers'],
+                                         Mean=round(long.mean() - short.mean(), 3),
+                                         **{'Period Return': round(compounded(returns[buckets + 1]), 5)})
+    return period_stats
+
+def calendar_periods(metric, index, start_date, end_date, frequency, outliers=None, normalize='zscore', buckets=5,
+                     long_short=False, **kwargs):
+    # yields (rebalance date, [(dates, daily returns) arrays per portfolio], stats) one period at a time;
+    # ranks only where constituents or published fundamentals change, and prices each run of
+    # unchanged portfolios with one equal_weight_returns call that is then split into periods
+    dates, ends = calendar_schedule(start_date, end_date, frequency, index)
+    if not dates:
+        return
+    matrix = return_matrix(index, dates[0], ends[-1])
+    starts = np.flatnonzero(ranking_changes(dates, index))
+    stops = np.append(starts[1:], len(dates))
+    snapshots = historical_snapshots([dates[first] for first in starts], index)
+    n_portfolios = buckets + 1 + bool(long_short)
+
+    for first, stop in zip(starts, stops):
+        with period(dates[first].strftime('%Y-%m-%d')):
+            # one sorted snapshot and its bucket offsets; the portfolios are slices of its arrays
+            df, offsets = bucket_snapshot(snapshots[dates[first]], metric, outliers, normalize, buckets)
+            tickers = df['TICKER'].to_numpy(dtype=object)
+            metric_values = df[metric_column(metric)].to_numpy(dtype=float)
+            portfolio_tickers = [tickers[offsets[i]:offsets[i + 1]] for i in range(buckets + 1)]
+            run_returns = bucket_returns(matrix, portfolio_tickers, dates[first], ends[stop - 1],
+                                         spreads=[(buckets, 1)] if long_short else [])
+            run_stats = period_stats_rows(tickers, metric_values, offsets, dates[first], [r for _, r in run_returns],
+                                          long_short)
+        run_dates = [period_dates for period_dates, _ in run_returns]
+        run_values = [period_returns for _, period_returns in run_returns]
+
+        for j in range(first, stop):
+            start, end = dates[j].to_datetime64(), pd.to_datetime(ends[j]).to_datetime64()
+            period_returns, period_stats = [], {}
+            for i in range(n_portfolios):
+                lo = np.searchsorted(run_dates[i], start, side='left')
+                hi = np.searchsorted(run_dates[i], end, side='right')
+                values = run_values[i][lo:hi].copy()
+                if hi > lo and run_dates[i][lo] == start:
+                    # returns are measured within the period, so its first day has none
+                    values[0] = np.nan
+                period_returns.append((run_dates[i][lo:hi], values))
+
+                if i in run_stats:
+                    period_stats[i] = dict(run_stats[i], Year=dates[j].year, Month=dates[j].month, Date=dates[j])
+                    period_stats[i]['Period Return'] = round(compounded(values), 5)
+            yield dates[j], period_returns, period_stats
+
+def portfolio_periods(metric, index, start_date='2000-06-30', end_date='2023-12-31', frequency='yearly', mcap=False,
+                      buckets=5, long_short=False, **kwargs):
+    # yields (rebalance date, daily returns, stats) one period at a time
+    if mcap:
+        frequency = 'monthly'
+    if is_calendar(frequency):
+        for current_date, returns, period_stats in calendar_periods(metric, index, start_date, end_date, frequency,
+                                                                    buckets=buckets, long_short=long_short, **kwargs):
+            yield current_date, [pd.DataFrame({'Date': d, 'Return': r}) for d, r in returns], period_stats
+        return
+    dates = rebalance_dates(start_date, end_date, frequency)
+    if not dates:
+        return
+
+    # one daily return matrix covering every period
+    matrix = None
+    if not mcap:
+        matrix = return_matrix(index, dates[0], period_end(dates[-1], frequency))
+
+    for current_date in dates:
+        # tag the period's stages here rather than around the yield, which hands control to the caller
+        with period(current_date.strftime('%Y-%m-%d')):
+            if mcap:
+                returns, portfolios = mcap_backtest(metric, current_date.strftime('%Y-%m-%d'), index, buckets,
+                                                    long_short, **kwargs)
+            else:
+                returns, portfolios = backtest(metric, current_date.strftime('%Y-%m-%d'), index, frequency, matrix,
+                                               buckets, long_short, **kwargs)
+
+            with stage('backtest.period_stats'):
+                column = metric_column(metric)
+                tickers = np.concatenate([portfolio['TICKER'].to_numpy(dtype=object) for portfolio in portfolios])
+                values = np.concatenate([portfolio[column].to_numpy(dtype=float) for portfolio in portfolios])
+                offsets = np.concatenate([[0], np.cumsum([len(portfolio) for portfolio in portfolios])])
+                period_stats = period_stats_rows(tickers, values, offsets, current_date,
+                                                 [r['Return'].to_numpy(dtype=float) for r in returns], long_short)
+
+        yield current_date, returns, period_stats
+
+@profiled
+@cached(ignore=('checkpoint', 'checkpoint_every'))
+def rebalanced_portfolio(metric, index, start_date='2000-06-30', end_date='2023-12-31', frequency='yearly', mcap=False,
+                         checkpoint=None, checkpoint_every=12, buckets=5, long_short=False, **kwargs):
+    if mcap:
+        frequency = 'monthly'
+    dates, ends = rebalance_schedule(start_date, end_date, frequency, index)
+    # canonical keeps every date of a custom schedule, where repr would shorten it to its ends
+    params = canonical((metric, index, pd.to_datetime(start_date), pd.to_datetime(end_date), frequency, mcap, buckets,
+                        long_short, kwargs))
+    # <= 0, the N-tiles, then top minus bottom
+    n_portfolios = buckets + 1 + bool(long_short)
+
+    # preallocate daily returns: periods share at most their boundary day
+    capacity = len(dates)
+    if dates and not mcap:
+        lo, hi = date_window(price_panel(index)[0], dates[0], ends[-1])
+        capacity += hi - lo
+    return_dates = np.empty((n_portfolios, capacity), dtype='datetime64[ns]')
+    daily_returns = np.empty((n_portfolios, capacity))
+    filled = np.zeros(n_portfolios, dtype=int)
+    portfolio_stats = {i: [] for i in range(n_portfolios)}
+    done = 0
+
+    if checkpoint is not None and os.path.exists(checkpoint):
+        state = pd.read_pickle(checkpoint)
+        if state['params'] == params:
+            done, portfolio_stats = state['done'], state['stats']
+            for i in range(n_portfolios):
+                filled[i] = len(state['returns'][i])
+                return_dates[i, :filled[i]] = state['dates'][i]
+                daily_returns[i, :filled[i]] = state['returns'][i]
+
+    periods = []
+    if done < len(dates) and is_calendar(frequency):
+        periods = calendar_periods(metric, index, dates[done], end_date, frequency, buckets=buckets,
+                                   long_short=long_short, **kwargs)
+    elif done < len(dates):
+        periods = ((current_date, [(r['Date'].to_numpy(dtype='datetime64[ns]'), r['Return'].to_numpy(dtype=float))
+                                   for r in returns], period_stats)
+                   for current_date, returns, period_stats in
+                   portfolio_periods(metric, index, dates[done], end_date, frequency, mcap, buckets, long_short,
+                                     **kwargs))
+    for current_date, returns, period_stats in periods:
+        for i in range(n_portfolios):
+            period_dates, period_returns = returns[i]
+            n = len(period_dates)
+            if filled[i] + n > return_dates.shape[1]:
+                grow = max(n, return_dates.shape[1])
+                return_dates = np.concatenate([return_dates, np.empty((n_portfolios, grow), dtype='datetime64[ns]')],
+                                              axis=1)
+                daily_returns = np.concatenate([daily_returns, np.empty((n_portfolios, grow))], axis=1)
+            return_dates[i, filled[i]:filled[i] + n] = period_dates
+            daily_returns[i, filled[i]:filled[i] + n] = period_returns
+            filled[i] += n
+            if i in period_stats:
+                portfolio_stats[i].append(period_stats[i])
+
+        done += 1
+        if checkpoint is not None and (done % checkpoint_every == 0 or done == len(dates)):
+            state = {'params': params, 'done': done, 'stats': portfolio_stats,
+                     'dates': [return_dates[i, :filled[i]].copy() for i in range(n_portfolios)],
+                     'returns': [daily_returns[i, :filled[i]].copy() for i in range(n_portfolios)]}
+            with stage('backtest.checkpoint'):
+                pd.to_pickle(state, checkpoint + '.tmp')
+            os.replace(checkpoint + '.tmp', checkpoint)
+
+    cumulative_portfolios = [pd.DataFrame({'Date': return_dates[i, :filled[i]],
+                                           'Return': np.nan_to_num(daily_returns[i, :filled[i]], nan=0.0)})
+                             for i in range(n_portfolios)]
 
     return cumulative_portfolios, portfolio_stats
@@ -0,0 +1,135 @@
+import os
+import time
+import pickle
+import hashlib
+import inspect
+import functools
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from datastore import DATA_DIR, TABLES, csv_path, store_path
+
+#-------------------[cache]------------------#
+#                                            #
+#   on-disk results keyed by the arguments   #
+#   and a fingerprint of the data files,     #
+#   evicted least recently used first        #
+#                                            #
+#--------------------------------------------#
+
+CACHE_DIR = os.environ.get('PORTFOLIO_CACHE_DIR', os.path.join(DATA_DIR, 'cache'))
+CACHE_SIZE = int(os.environ.get('PORTFOLIO_CACHE_SIZE', 2 * 1024 ** 3))
+cache_enabled = os.environ.get('PORTFOLIO_CACHE', '1') != '0'
+_writes = 0
+_code_version = None
+
+# scripts that only call into the library; editing their parameters leaves cached results valid
+entry_points = ('main.py', 'sweep.py', 'report.py', 'benchmark.py', 'synthetic.py', 'profiling.py')
+
+def data_fingerprint():
+    # changes whenever a source CSV or its Parquet copy is rewritten
+    paths = [path for table in TABLES for path in (csv_path(table), store_path(table))]
+
+    stats = []
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            stats.append((path, st.st_size, st.st_mtime_ns))
+    return hashlib.sha256(repr(stats).encode()).hexdigest()
+
+def code_version():
+    # hash of the source of every library module, read once per process; entry point scripts are left out
+    global _code_version
+    if _code_version is None:
+        code_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(code_dir)):
+            if name.endswith('.py') and name not in entry_points:
+                with open(os.path.join(code_dir, name), 'rb') as f:
+                    digest.update(name.encode() + b'\0' + f.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+def canonical(value):
+    # a hashable form that keeps every element: repr shortens long arrays & indexes to their ends
+    if isinstance(value, dict):
+        return tuple(sorted((canonical(k), canonical(v)) for k, v in value.items()))
+    if isinstance(value, (pd.Timestamp, date, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, (list, tuple, set, np.ndarray, pd.Index, pd.Series)):
+        items = sorted(value) if isinstance(value, set) else value
+        return tuple(canonical(item) for item in items)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def cache_key(func, args, kwargs, ignore=()):
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = {name: value for name, value in bound.arguments.items() if name not in ignore}
+    payload = (func.__module__, func.__qualname__, canonical(arguments), code_version(), data_fingerprint())
+    return hashlib.sha256(pickle.dumps(payload)).hexdigest()
+
+def evict(max_size=None):
+    max_size = CACHE_SIZE if max_size is None else max_size
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith('.pkl'):
+            try:
+                st = os.stat(os.path.join(CACHE_DIR, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def clear_cache():
+    evict(max_size=0)
+
+def cached(func=None, ignore=()):
+    if func is None:
+        return functools.partial(cached, ignore=ignore)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _writes
+        if not cache_enabled:
+            return func(*args, **kwargs)
+
+        path = os.path.join(CACHE_DIR, cache_key(func, args, kwargs, ignore) + '.pkl')
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            os.utime(path)  # mark as recently used
+            return result
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            pass
+
+        result = func(*args, **kwargs)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.{time.time_ns()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            _writes += 1
+            if _writes % 64 == 1:
+                evict()
+        except OSError:
+            pass
+        return result
+
+    return wrapper
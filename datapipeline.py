@@ -1,5 +1,8 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from datastore import load, load_arrays, save_arrays, table_columns
+from profiling import profiled
 
 #----------------[NASDAQ 100]----------------#
 #                                            #
@@ -14,93 +17,305 @@ from datetime import datetime, timedelta
 #                                            #
 #--------------------------------------------#
 
-def nasdaq_tickers(date):
-    df = pd.read_csv('/Users/aryaman/Downloads/nasdaqconstituents.csv')
-    df['from'] = pd.to_datetime(df['from'])
-    df['thru'] = pd.to_datetime(df['thru'], errors='coerce')
+#-------------[index membership]-------------#
+#                                            #
+#   date x ticker membership matrix built    #
+#   once per index from constituent files    #
+#                                            #
+#--------------------------------------------#
 
-    date = pd.to_datetime(date)
-    filtered_df = df[(df['from'] <= date) & ((df['thru'].isna()) | (df['thru'] >= date))]
-    tickers = filtered_df['co_tic'].tolist()
+_memberships = {}
 
-    return tickers
+def _nasdaq_membership():
+    df = load('nasdaqconstituents', columns=['from', 'thru', 'co_tic']).dropna(subset=['co_tic'])
+    tickers = pd.Index(df['co_tic'].unique())
+    leave = df['thru'] + pd.Timedelta(days=1)
+    dates = pd.DatetimeIndex(pd.concat([df['from'], leave.dropna()]).unique()).sort_values()
 
-def russell200_tickers(date):
-    russell_data = pd.read_csv('/Users/aryaman/Downloads/russell200constituents.csv', parse_dates=['Date'])
+    # +1 on the day a ticker joins, -1 on the day after it leaves
+    changes = np.zeros((len(dates) + 1, len(tickers)), dtype=np.int32)
+    cols = tickers.get_indexer(df['co_tic'])
+    np.add.at(changes, (dates.get_indexer(df['from']), cols), 1)
+    left = leave.notna().values
+    np.add.at(changes, (dates.get_indexer(leave[left]), cols[left]), -1)
+    matrix = np.cumsum(changes[:-1], axis=0) > 0
+    return dates.values, tickers, matrix
+
+def _russell200_membership():
+    df = load('russell200constituents', columns=['Date', 'Ticker']).dropna(subset=['Ticker'])
+    dates = pd.DatetimeIndex(df['Date'].unique()).sort_values()
+    tickers = pd.Index(df['Ticker'].unique())
+    matrix = np.zeros((len(dates), len(tickers)), dtype=bool)
+    matrix[dates.get_indexer(df['Date']), tickers.get_indexer(df['Ticker'])] = True
+    return dates.values, tickers, matrix
+
+def _sp500_membership():
+    df = load('sp500historicalconstituents', columns=['date', 'tickers']).sort_values(by='date')
+    lists = [t.strip("[]").replace("'", "").split(", ") for t in df['tickers']]
+    dates = pd.DatetimeIndex(df['date'].dt.to_period('M').dt.start_time)
+    tickers = pd.Index(pd.unique(np.concatenate(lists)))
+    matrix = np.zeros((len(dates), len(tickers)), dtype=bool)
+    for row, tickers_list in enumerate(lists):
+        matrix[row, tickers.get_indexer(tickers_list)] = True
+    return dates.values, tickers, matrix
+
+@profiled
+def membership(index):
+    # (sorted snapshot dates, tickers, date x ticker boolean matrix)
+    if index not in _memberships:
+        if index == 'nasdaq100':
+            _memberships[index] = _nasdaq_membership()
+        elif index == 'russell200':
+            _memberships[index] = _russell200_membership()
+        elif index == 'sp500':
+            _memberships[index] = _sp500_membership()
+        else:
+            raise ValueError("Invalid index.")
+    return _memberships[index]
+
+@profiled
+def constituents_many(dates, index):
+    snapshot_dates, tickers, matrix = membership(index)
+    dates = pd.to_datetime(pd.Index(dates))
+    rows = np.searchsorted(snapshot_dates, dates.values, side='right') - 1
+    return {date: tickers[matrix[row]].tolist() if row >= 0 else [] for date, row in zip(dates, rows)}
+
+@profiled
+def membership_mask(dates, index, tickers):
+    # dates x tickers boolean membership for an arbitrary ticker axis
+    snapshot_dates, members, matrix = membership(index)
+    rows = np.searchsorted(snapshot_dates, pd.to_datetime(pd.Index(dates)).values, side='right') - 1
+    cols = members.get_indexer(pd.Index(tickers))
+    mask = matrix[np.maximum(rows, 0)][:, np.maximum(cols, 0)]
+    mask[rows < 0] = False
+    mask[:, cols < 0] = False
+    return mask
+
+def constituents(date, index):
     date = pd.to_datetime(date)
-    filtered_data = russell_data[russell_data['Date'] <= date]
-    if filtered_data.empty:
-        return []
+    return constituents_many([date], index)[date]
 
-    most_recent_date = filtered_data['Date'].max()
-    data = filtered_data[filtered_data['Date'] == most_recent_date]
-    return data['Ticker'].unique().tolist()
+def nasdaq_tickers(date):
+    return constituents(date, 'nasdaq100')
+
+def russell200_tickers(date):
+    return constituents(date, 'russell200')
 
 def sp500_tickers(date):
-    date = pd.to_datetime(date).to_period('M')
-    df = pd.read_csv('/Users/aryaman/Downloads/sp500historicalconstituents.csv')
-    df['date'] = pd.to_datetime(df['date'], format='%Y-%m').dt.to_period('M')
+    return constituents(date, 'sp500')
+
+#------------[fundamentals index]------------#
+#                                            #
+#   fundamentals sorted by (TICKER, date)    #
+#  with a single as-of lookup per universe   #
+#                                            #
+#--------------------------------------------#
+
+fundamentals_tables = {'nasdaq100': 'nasdaq100historicaldata',
+                       'russell200': 'russell200historicaldata',
+                       'sp500': 'sp500historicaldata'}
+metrics = ['CAPEI', 'bm', 'evm', 'pe_op_basic', 'pe_op_dil', 'pe_exi', 'pe_inc', 'ps', 'pcf', 'dpr', 'npm',
+           'opmbd', 'opmad', 'gpm', 'ptpm', 'cfm', 'roa', 'roe', 'roce', 'efftax', 'aftret_eq', 'aftret_invcapx',
+           'aftret_equity', 'pretret_noa', 'pretret_earnat', 'GProf', 'equity_invcap', 'debt_invcap',
+           'totdebt_invcap', 'capital_ratio', 'int_debt', 'int_totdebt', 'cash_lt', 'invt_act', 'rect_act',
+           'debt_at', 'debt_ebitda', 'short_debt', 'curr_debt', 'lt_debt', 'profit_lct', 'ocf_lct', 'cash_debt',
+           'fcf_ocf', 'lt_ppent', 'dltt_be', 'debt_assets', 'debt_capital', 'de_ratio', 'intcov', 'intcov_ratio',
+           'cash_ratio', 'quick_ratio', 'curr_ratio', 'cash_conversion', 'inv_turn', 'at_turn', 'rect_turn',
+           'pay_turn', 'sale_invcap', 'sale_equity', 'sale_nwc', 'rd_sale', 'adv_sale', 'staff_sale', 'accrual',
+           'ptb', 'PEG_trailing', 'divyield']
+# identifier and filing-date columns carried alongside the metrics
+fundamental_ids = ['gvkey', 'permno', 'adate', 'qdate']
+_fundamentals = {}
 
-    closest_date = df[df['date'] <= date]['date'].max()
-    tickers = df[df['date'] == closest_date]['tickers'].values[0]
-    tickers_list = tickers.strip("[]").replace("'", "").split(", ")
+def _day(dates):
+    return pd.to_datetime(dates).values.astype('datetime64[D]').astype(np.int64) + 2 ** 31
 
-    return tickers_list
+def _to_numeric(column):
+    # WRDS writes some ratios (divyield) as percentage strings like '1.2%'; those are scaled to 0.012
+    if pd.api.types.is_numeric_dtype(column):
+        return pd.to_numeric(column, errors='coerce')
+    text = column.astype(str).str.strip()
+    values = pd.to_numeric(text.str.rstrip('%'), errors='coerce')
+    return values.where(~text.str.endswith('%'), values / 100)
 
+@profiled
+def fundamentals_index(index):
+    # (sorted fundamentals, ticker -> code index, sorted code << 32 | day keys)
+    # kept compact: categorical TICKER and filing dates, integer ids, float32 metrics, and public_date only as
+    # the day number in the keys
+    if index not in _fundamentals:
+        if index not in fundamentals_tables:
+            raise ValueError("Invalid index.")
+        table = fundamentals_tables[index]
+        available = set(table_columns(table))
+        id_cols = [c for c in fundamental_ids if c in available]
+        metric_cols = [m for m in metrics if m in available]
+        df = load(table, columns=id_cols + ['TICKER', 'public_date'] + metric_cols,
+                  dtypes={c: 'category' for c in ['adate', 'qdate', 'TICKER'] if c in available})
+        df = df.dropna(subset=['TICKER', 'public_date'])
+        for c in ['gvkey', 'permno']:
+            if c in df.columns:
+                df[c] = pd.to_numeric(df[c], downcast='integer')
+        # converted per column, so a stray non-numeric token blanks that value instead of failing the load
+        for m in metric_cols:
+            df[m] = _to_numeric(df[m]).astype('float32')
+
+        tickers = df['TICKER'].cat.remove_unused_categories()
+        df['TICKER'] = tickers.cat.reorder_categories(tickers.cat.categories.sort_values())
+        keys = (df['TICKER'].cat.codes.to_numpy(dtype=np.int64) << 32) | _day(df['public_date'])
+        order = np.argsort(keys, kind='stable')
+        df = df[id_cols + ['TICKER'] + metric_cols].iloc[order].reset_index(drop=True)
+        _fundamentals[index] = (df, pd.Index(df['TICKER'].cat.categories, dtype=object), keys[order])
+    return _fundamentals[index]
+
+def _snapshot(index, rows):
+    # expand compact rows back to the table's columns: ids, filing dates, public_date, TICKER and float64 metrics
+    df, _, keys = fundamentals_index(index)
+    rows_df = df.iloc[rows]
+    days = (keys[rows] & 0xFFFFFFFF) - 2 ** 31
+    ids = [c for c in fundamental_ids if c in rows_df.columns]
+    snapshot = rows_df[ids].astype({c: object for c in ['adate', 'qdate'] if c in ids})
+    snapshot['public_date'] = days.astype('datetime64[D]').astype('datetime64[ns]')
+    snapshot['TICKER'] = np.asarray(rows_df['TICKER'], dtype=object)
+    return pd.concat([snapshot, rows_df.drop(columns=ids + ['TICKER']).astype(float)], axis=1)
+
+def _asof_positions(index, tickers, days):
+    df, ticker_codes, keys = fundamentals_index(index)
+    codes = ticker_codes.get_indexer(tickers).astype(np.int64)
+    known = codes >= 0
+    query = (codes[known] << 32) | days[known]
+    pos = np.searchsorted(keys, query, side='right') - 1
+    hit = (pos >= 0) & ((keys[np.maximum(pos, 0)] >> 32) == codes[known])
+    return np.flatnonzero(known)[hit], pos[hit]
+
+@profiled
+def fundamentals_asof(tickers, date, index):
+    tickers = pd.Index(tickers)
+    days = np.full(len(tickers), _day([date])[0])
+    _, rows = _asof_positions(index, tickers, days)
+    return _snapshot(index, rows)
+
+@profiled
+def historical_snapshots(dates, index):
+    # the result is keyed by date, so repeated dates share one snapshot
+    dates = pd.to_datetime(pd.Index(dates)).unique()
+    universes = list(constituents_many(dates, index).values())
+    tickers = pd.Index(np.concatenate([np.asarray(u, dtype=object) for u in universes]))
+    owner = np.repeat(np.arange(len(dates)), [len(u) for u in universes])
+    slots, rows = _asof_positions(index, tickers, _day(dates)[owner])
+
+    snapshots = _snapshot(index, rows)
+    owner = owner[slots]
+    return {date: snapshots[owner == i] for i, date in enumerate(dates)}
+
+@profiled
 def historical_data(given_date, index):
-    if index == 'nasdaq100':
-        ticker_list = nasdaq_tickers(given_date)
-        df = pd.read_csv('/Users/aryaman/Downloads/nasdaq100historicaldata.csv')
-    elif index == 'russell200':
-        ticker_list = russell200_tickers(given_date)
-        df = pd.read_csv('/Users/aryaman/Downloads/russell200historicaldata.csv')
-    elif index == 'sp500':
-        ticker_list = sp500_tickers(given_date)
-        df = pd.read_csv('/Users/aryaman/Downloads/sp500historicaldata.csv')
-    else:
-        raise ValueError("Invalid index.")
-
-    df['public_date'] = pd.to_datetime(df['public_date'])
-    df_filtered = df[df['TICKER'].isin(ticker_list)]
     given_date = pd.to_datetime(given_date)
-    most_recent_rows = []
+    ticker_list = constituents(given_date, index)
+    return fundamentals_asof(ticker_list, given_date, index)
+
+
+#----------------[price panel]---------------#
+#                                            #
+#   date x ticker price matrix per index,    #
+#   sliced by binary search on the dates     #
+#                                            #
+#--------------------------------------------#
+
+price_tables = {'nasdaq100': 'nasdaqprices',
+                'russell200': 'russell200prices',
+                'sp500': 'sp500prices'}
+_price_panels = {}
+
+@profiled
+def _build_price_panel(table):
+    # float32 prices keep about 7 significant digits, plenty for daily closes; returns are taken in float64
+    df = load(table, columns=['datadate', 'tic', 'prccd'], dtypes={'tic': 'category', 'prccd': 'float32'})
+    df = df.dropna(subset=['datadate', 'tic'])
+    tickers = df['tic'].cat.remove_unused_categories()
+    dates = np.unique(df['datadate'].values)
+    values = np.full((len(dates), len(tickers.cat.categories)), np.nan, dtype=np.float32)
+    values[np.searchsorted(dates, df['datadate'].values), tickers.cat.codes.values] = df['prccd'].values
+    return dates, np.asarray(tickers.cat.categories, dtype=str), values
+
+@profiled
+def price_panel(index):
+    # (sorted dates, ticker -> column index, date x ticker price matrix)
+    # loaded on first use and memory-mapped from the store when possible
+    if index not in _price_panels:
+        if index not in price_tables:
+            raise ValueError("Invalid index. Use 'nasdaq100', 'russell200' or 'sp500'.")
+
+        table = price_tables[index]
+        keys = ['dates', 'tickers', 'values']
+        arrays = load_arrays(table, keys, source=table)
+        if arrays is None:
+            arrays = _build_price_panel(table)
+            try:
+                save_arrays(table, **dict(zip(keys, arrays)))
+                arrays = load_arrays(table, keys)
+            except OSError:
+                pass
+
+        dates, tickers, values = arrays
+        _price_panels[index] = (dates, pd.Index(np.asarray(tickers)), values)
+    return _price_panels[index]
+
+def date_window(dates, start_date, end_date):
+    lo = np.searchsorted(dates, pd.to_datetime(start_date).to_datetime64(), side='left')
+    hi = np.searchsorted(dates, pd.to_datetime(end_date).to_datetime64(), side='right')
+    return lo, hi
+
+@profiled
+def prices(tickers, start_date, end_date, index):
+    dates, columns, values = price_panel(index)
+    lo, hi = date_window(dates, start_date, end_date)
+    tickers = pd.Index(tickers)
+    cols = columns.get_indexer(tickers)
+    found = cols >= 0
+
+    price_data = pd.DataFrame(np.asarray(values[lo:hi, cols[found]], dtype=float), index=pd.DatetimeIndex(dates[lo:hi], name='datadate'),
+                              columns=tickers[found])
+    return price_data.dropna(axis=1, how='all').dropna(axis=0, how='all')
 
-    for ticker in ticker_list:
-        ticker_data = df_filtered[df_filtered['TICKER'] == ticker]
-        recent_data = ticker_data[ticker_data['public_date'] <= given_date].sort_values(by='public_date',
-                                                                                        ascending=False).head(1)
-        if not recent_data.empty:
-            most_recent_rows.append(recent_data)
+@profiled
+def prices_asof(tickers, dates, index, limit=5):
+    # dates x tickers array of the last price on or before each date, looking back at most limit trading days
+    panel_dates, columns, values = price_panel(index)
+    rows = np.searchsorted(panel_dates, pd.to_datetime(pd.Index(dates)).values, side='right') - 1
+    cols = columns.get_indexer(pd.Index(tickers))
+    found = cols >= 0
 
-    most_recent_df = pd.concat(most_recent_rows)
-    return most_recent_df
+    asof = np.full((len(rows), len(cols)), np.nan)
+    for lag in range(limit):
+        lagged = rows - lag
+        ok = lagged >= 0
+        block = np.full((len(rows), found.sum()), np.nan)
+        block[ok] = values[lagged[ok]][:, cols[found]]
+        missing = np.isnan(asof[:, found])
+        asof[:, found] = np.where(missing, block, asof[:, found])
+    return asof
 
+def last_prices(tickers, start_date, end_date, index):
+    # last valid price of each ticker within [start_date, end_date], so a stock that stops trading
+    # partway through keeps its final price instead of dropping out
+    panel_dates, columns, values = price_panel(index)
+    lo, hi = date_window(panel_dates, start_date, end_date)
+    cols = columns.get_indexer(pd.Index(tickers))
+    found = cols >= 0
 
-# Load price dataframes
-nasdaq_prices = pd.read_csv('/Users/aryaman/Downloads/nasdaqprices.csv', parse_dates=['datadate'])
-russell_prices = pd.read_csv('/Users/aryaman/Downloads/russell200prices.csv', parse_dates=['datadate'])
-sp500_prices = pd.read_csv('/Users/aryaman/Downloads/sp500prices.csv',
-                             parse_dates=['datadate'])
+    last = np.full(len(cols), np.nan)
+    window = np.asarray(values[lo:hi][:, cols[found]], dtype=float)
+    if len(window):
+        traded = ~np.isnan(window)
+        rows = len(window) - 1 - np.argmax(traded[::-1], axis=0)
+        last[found] = np.where(traded.any(axis=0), window[rows, np.arange(window.shape[1])], np.nan)
+    return last
 
+@profiled
 def price(ticker, start_date, end_date, index):
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    if index == 'nasdaq100':
-        historical_prices = nasdaq_prices
-    elif index == 'russell200':
-        historical_prices = russell_prices
-    elif index == 'sp500':
-        historical_prices = sp500_prices
-    else:
-        raise ValueError("Invalid index. Use 'nasdaq100' or 'russell200'.")
-
-    ticker_data = historical_prices[(historical_prices['tic'] == ticker) &
-                                    (historical_prices['datadate'] >= start_date) &
-                                    (historical_prices['datadate'] <= end_date)]
-
-    if ticker_data.empty:
-        print(f"Ticker {ticker} not found or no data available in the given date range.")
+    price_data = prices([ticker], start_date, end_date, index)
+    if price_data.empty:
         return None
 
-    return ticker_data[['datadate', 'prccd']].set_index('datadate').sort_index()
+    return price_data.rename(columns={ticker: 'prccd'})
@@ -0,0 +1,222 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+#-----------------[datastore]----------------#
+#                                            #
+#  one-time ingest of CRSP & Compustat CSVs  #
+#   into a Parquet store partitioned by year #
+#                                            #
+#--------------------------------------------#
+
+DATA_DIR = os.environ.get('PORTFOLIO_DATA_DIR', '/Users/aryaman/Downloads')
+STORE_DIR = os.environ.get('PORTFOLIO_STORE_DIR', os.path.join(DATA_DIR, 'store'))
+
+# table name (csv file stem) -> (date column, date format, sort columns)
+TABLES = {
+    'nasdaq100historicaldata': ('public_date', None, ['public_date', 'TICKER']),
+    'russell200historicaldata': ('public_date', None, ['public_date', 'TICKER']),
+    'sp500historicaldata': ('public_date', None, ['public_date', 'TICKER']),
+    'nasdaqprices': ('datadate', None, ['datadate', 'tic']),
+    'russell200prices': ('datadate', None, ['datadate', 'tic']),
+    'sp500prices': ('datadate', None, ['datadate', 'tic']),
+    'nasdaqconstituents': ('from', None, ['from']),
+    'russell200constituents': ('Date', None, ['Date', 'Ticker']),
+    'sp500historicalconstituents': ('date', '%Y-%m', ['date']),
+    'sp500monthlyreturn': ('MthCalDt', None, ['MthCalDt', 'Ticker']),
+}
+
+# table name -> ticker column, for ticker predicates
+TICKER_COLUMNS = {
+    'nasdaq100historicaldata': 'TICKER',
+    'russell200historicaldata': 'TICKER',
+    'sp500historicaldata': 'TICKER',
+    'nasdaqprices': 'tic',
+    'russell200prices': 'tic',
+    'sp500prices': 'tic',
+    'nasdaqconstituents': 'co_tic',
+    'russell200constituents': 'Ticker',
+    'sp500monthlyreturn': 'Ticker',
+}
+
+# rows per CSV block; peak memory while reading is one block plus the rows kept so far
+CHUNK_ROWS = int(os.environ.get('PORTFOLIO_CHUNK_ROWS', 500_000))
+
+def csv_path(table):
+    return os.path.join(DATA_DIR, f'{table}.csv')
+
+def store_path(table):
+    return os.path.join(STORE_DIR, table)
+
+def source_mtime(table):
+    path = store_path(table) if os.path.isdir(store_path(table)) else csv_path(table)
+    return os.path.getmtime(path)
+
+def table_columns(table):
+    # column names without reading any rows
+    if os.path.isdir(store_path(table)):
+        import pyarrow.parquet as pq
+        return [name for name in pq.ParquetDataset(store_path(table)).schema.names if name != 'year']
+    return pd.read_csv(csv_path(table), nrows=0).columns.tolist()
+
+def read_chunks(table, columns=None, start=None, end=None, tickers=None, dtypes=None, chunksize=None):
+    # streams the CSV in blocks of chunksize rows, yielding only the rows that pass the predicates
+    date_col, date_format, _ = TABLES[table]
+    ticker_col = TICKER_COLUMNS.get(table)
+    if tickers is not None and ticker_col is None:
+        raise ValueError(f"{table} has no ticker column.")
+    usecols = columns
+    if usecols is not None:
+        usecols = list(usecols) + [col for col in (date_col, ticker_col if tickers is not None else None)
+                                   if col is not None and col not in usecols]
+    start = pd.to_datetime(start) if start is not None else None
+    end = pd.to_datetime(end) if end is not None else None
+    tickers = pd.Index(tickers) if tickers is not None else None
+
+    for chunk in pd.read_csv(csv_path(table), usecols=usecols, dtype=dtypes or None,
+                             chunksize=chunksize or CHUNK_ROWS):
+        chunk[date_col] = pd.to_datetime(chunk[date_col], format=date_format)
+        if table == 'nasdaqconstituents' and 'thru' in chunk.columns:
+            chunk['thru'] = pd.to_datetime(chunk['thru'], errors='coerce')
+
+        keep = np.ones(len(chunk), dtype=bool)
+        if start is not None:
+            keep &= (chunk[date_col] >= start).to_numpy()
+        if end is not None:
+            keep &= (chunk[date_col] <= end).to_numpy()
+        if tickers is not None:
+            keep &= chunk[ticker_col].isin(tickers).to_numpy()
+        if not keep.all():
+            chunk = chunk[keep]
+        if columns is not None:
+            chunk = chunk[list(columns)]
+        yield chunk
+
+def _concat(chunks, columns=None):
+    # categoricals read block by block carry different categories; union them instead of falling back to objects
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    chunks = [chunk for chunk in chunks if len(chunk)] or chunks[:1]
+    df = pd.concat(chunks, ignore_index=True)
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = pd.api.types.union_categoricals([chunk[col] for chunk in chunks])
+    return df
+
+def _common_dtypes(kinds):
+    # one dtype per column across blocks, so every year partition shares a schema
+    casts = {}
+    for col, seen in kinds.items():
+        if len(seen) > 1:
+            casts[col] = 'float64' if seen <= set('iuf') else 'string'
+    return casts
+
+def ingest(tables=None, chunksize=None):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("pyarrow is required to build the Parquet store.")
+
+    for table in tables or TABLES:
+        date_col, _, sort_cols = TABLES[table]
+        path = store_path(table)
+        staging = path + '.staging'
+        shutil.rmtree(staging, ignore_errors=True)
+
+        # pass 1: stream blocks into per-year staging files
+        kinds, rows = {}, 0
+        for i, chunk in enumerate(read_chunks(table, chunksize=chunksize)):
+            if chunk.empty:
+                continue
+            for col, dtype in chunk.dtypes.items():
+                kinds.setdefault(col, set()).add(dtype.kind)
+            for year, part in chunk.groupby(chunk[date_col].dt.year.fillna(0).astype(int)):
+                year_dir = os.path.join(staging, f'year={year}')
+                os.makedirs(year_dir, exist_ok=True)
+                part.to_parquet(os.path.join(year_dir, f'block-{i:05d}.parquet'), index=False)
+            rows += len(chunk)
+
+        # pass 2: sort one year at a time, so peak memory is a year of rows
+        casts = _common_dtypes(kinds)
+        for year_dir in sorted(os.listdir(staging)) if os.path.isdir(staging) else []:
+            year_path = os.path.join(staging, year_dir)
+            blocks = sorted(os.listdir(year_path))
+            df = pd.concat([pd.read_parquet(os.path.join(year_path, block)) for block in blocks], ignore_index=True)
+            df = df.astype(casts).sort_values(by=sort_cols, kind='stable').reset_index(drop=True)
+            for block in blocks:
+                os.remove(os.path.join(year_path, block))
+            df.to_parquet(os.path.join(year_path, 'part-0.parquet'), index=False)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        if os.path.isdir(staging):
+            os.replace(staging, path)
+        shutil.rmtree(array_path(table), ignore_errors=True)
+        print(f"{table}: {rows} rows -> {path}")
+
+def load(table, columns=None, start=None, end=None, dtypes=None, tickers=None, chunksize=None):
+    # dtypes maps columns to compact types such as 'category' or 'float32', applied while reading;
+    # start, end and tickers are pushed down into the Parquet scan or applied to every CSV block
+    with stage(f'datastore.load.{table}'):
+        return _load(table, columns, start, end, dtypes, tickers, chunksize)
+
+def _load(table, columns=None, start=None, end=None, dtypes=None, tickers=None, chunksize=None):
+    date_col, date_format, _ = TABLES[table]
+    if columns is not None and date_col not in columns:
+        columns = [date_col] + list(columns)
+    start = pd.to_datetime(start) if start is not None else None
+    end = pd.to_datetime(end) if end is not None else None
+    dtypes = {col: dtype for col, dtype in (dtypes or {}).items() if columns is None or col in columns}
+
+    if os.path.isdir(store_path(table)):
+        filters = []
+        if start is not None:
+            filters += [('year', '>=', start.year), (date_col, '>=', start)]
+        if end is not None:
+            filters += [('year', '<=', end.year), (date_col, '<=', end)]
+        if tickers is not None:
+            filters += [(TICKER_COLUMNS[table], 'in', list(tickers))]
+        # dictionary encoded strings come back as categoricals without an object column in between
+        categories = [col for col, dtype in dtypes.items() if dtype == 'category']
+        df = pd.read_parquet(store_path(table), columns=columns, filters=filters or None,
+                             read_dictionary=categories or None)
+        df = df.drop(columns='year', errors='ignore').reset_index(drop=True)
+        return df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns})
+
+    chunks = list(read_chunks(table, columns, start, end, tickers, dtypes, chunksize))
+    return _concat(chunks, columns)
+
+#------------[memory-mapped arrays]----------#
+#                                            #
+#   derived NumPy arrays saved as .npy and   #
+#   opened read-only with np.load(mmap_mode) #
+#                                            #
+#--------------------------------------------#
+
+def array_path(name):
+    return os.path.join(STORE_DIR, 'arrays', name)
+
+def save_arrays(name, **arrays):
+    path = array_path(name)
+    os.makedirs(path, exist_ok=True)
+    for key, array in arrays.items():
+        # written beside the target & swapped in, so processes that have the old file mapped keep a whole copy
+        target = os.path.join(path, f'{key}.npy')
+        tmp = f'{target}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, target)
+
+def load_arrays(name, keys, source=None):
+    files = [os.path.join(array_path(name), f'{key}.npy') for key in keys]
+    if not all(os.path.exists(f) for f in files):
+        return None
+    if source is not None and min(os.path.getmtime(f) for f in files) < source_mtime(source):
+        return None
+    return [np.load(f, mmap_mode='r') for f in files]
+
+if __name__ == "__main__":
+    ingest()
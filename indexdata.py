@@ -0,0 +1,99 @@
+import os
+import pandas as pd
+
+from datastore import DATA_DIR
+
+#----------------[index data]----------------#
+#                                            #
+#  benchmark index closes (^NDX, ^SPX, ...)  #
+#   loaded once from a local file or any     #
+#   other source, returns derived in memory  #
+#                                            #
+#--------------------------------------------#
+
+# long format file with Date, Ticker, Close columns (.csv or .parquet)
+BENCHMARK_FILE = os.environ.get('PORTFOLIO_BENCHMARK_FILE', os.path.join(DATA_DIR, 'benchmarks.csv'))
+
+_source = None
+_benchmarks = {}
+
+def set_source(source):
+    # a file path, or a callable taking a ticker and returning a Series of closes indexed by date
+    global _source
+    _source = source
+    _benchmarks.clear()
+
+def yfinance_source(ticker):
+    import yfinance as yf
+
+    data = yf.download(ticker, start='1990-01-01', auto_adjust=False, progress=False)
+    close = data['Adj Close']
+    return close.iloc[:, 0] if isinstance(close, pd.DataFrame) else close
+
+def _read_file(path):
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path, columns=['Date', 'Ticker', 'Close'])
+    else:
+        df = pd.read_csv(path, usecols=['Date', 'Ticker', 'Close'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    for ticker, closes in df.groupby('Ticker'):
+        _benchmarks[ticker] = closes.set_index('Date')['Close'].sort_index()
+
+def benchmark(ticker):
+    if ticker not in _benchmarks:
+        source = _source
+        if source is None:
+            source = BENCHMARK_FILE if os.path.exists(BENCHMARK_FILE) else yfinance_source
+
+        if callable(source):
+            closes = pd.Series(source(ticker), dtype=float)
+            closes.index = pd.to_datetime(closes.index)
+            _benchmarks[ticker] = closes.sort_index()
+        else:
+            _read_file(source)
+
+    closes = _benchmarks.get(ticker)
+    if closes is None or closes.dropna().empty:
+        raise ValueError(f"No benchmark data for {ticker}.")
+    return closes.dropna()
+
+def benchmark_prices(ticker, start_date, end_date, interval='daily'):
+    # closes in [start_date, end_date); monthly bars are indexed by month start like yfinance's '1mo'
+    closes = benchmark(ticker)
+    closes = closes[(closes.index >= pd.to_datetime(start_date)) & (closes.index < pd.to_datetime(end_date))]
+    if interval == 'monthly':
+        closes = closes.resample('MS').last().dropna()
+    return closes
+
+def yearly_returns(ticker, start_date, end_date):
+    closes = benchmark(ticker)
+    start_date = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
+    yearly = []
+    current_date = start_date
+
+    while current_date < end_date:
+        next_year_date = current_date + pd.DateOffset(years=1)
+        year_closes = closes[(closes.index >= current_date) & (closes.index < next_year_date)]
+        if not year_closes.empty:
+            yearly.append({'Year': current_date.year,
+                           'Period Return': year_closes.iloc[-1] / year_closes.iloc[0] - 1})
+        current_date = next_year_date
+
+    return pd.DataFrame(yearly, columns=['Year', 'Period Return']).set_index('Year')
+
+def save_benchmarks(tickers=('^NDX', '^SPX', '^RUT', '^SPXEW', '^IXIC', '^GSPC'), path=BENCHMARK_FILE):
+    # snapshot closes from the current source so batch nodes can run without network access
+    frames = []
+    for ticker in tickers:
+        closes = benchmark(ticker)
+        frames.append(pd.DataFrame({'Date': closes.index, 'Ticker': ticker, 'Close': closes.values}))
+    df = pd.concat(frames, ignore_index=True)
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+if __name__ == "__main__":
+    print(f"Benchmarks written to {save_benchmarks()}")
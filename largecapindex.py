@@ -1,92 +1,129 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
-
-largecap_tickers = pd.read_csv('/Users/aryaman/Downloads/sp500historicalconstituents.csv', parse_dates=['date'])
+from datastore import load
+from datapipeline import constituents, membership, membership_mask
+from indexdata import benchmark_prices
+from profiling import profiled
 
 def all_largecap_tickers():
-    tickers = set()
-    for tickers_list in largecap_tickers['tickers']:
-        tickers.update(tickers_list.strip("[]").replace("'", "").split(", "))
-    return list(tickers)
+    _, tickers, matrix = membership('sp500')
+    return tickers[matrix.any(axis=0)].tolist()
 
 def process_csv():
-    df = pd.read_csv('/Users/aryaman/Downloads/sp500monthlyreturn.csv')
-    df['date'] = pd.to_datetime(df['MthCalDt']).dt.to_period('M')
+    df = load('sp500monthlyreturn', columns=['MthCalDt', 'Ticker', 'MthCap', 'MthRetx'])
+    df['date'] = df['MthCalDt'].dt.to_period('M')
     return df
 
 def largecap_tickers(date):
-    df = pd.read_csv('/Users/aryaman/Downloads/sp500historicalconstituents.csv')
-    df['date'] = pd.to_datetime(df['date'], format='%Y-%m').dt.to_period('M')
-
-    closest_date = df[df['date'] <= date]['date'].max()
-    tickers = df[df['date'] == closest_date]['tickers'].values[0]
-    tickers_list = tickers.strip("[]").replace("'", "").split(", ")
-
-    return tickers_list
-
+    return constituents(pd.Period(date, 'M').start_time, 'sp500')
+
+#----------[market cap weighting]------------#
+#                                            #
+#   monthly caps & returns pivoted once into #
+#   month x ticker arrays for cap weighting  #
+#                                            #
+#--------------------------------------------#
+
+_monthly_panels = {}
+
+@profiled
+def monthly_panel():
+    # (months, tickers, month x ticker MthCap matrix, month x ticker MthRetx matrix)
+    if 'sp500' not in _monthly_panels:
+        df = process_csv().dropna(subset=['Ticker'])
+        df = df.drop_duplicates(subset=['date', 'Ticker'], keep='first')
+        months = pd.PeriodIndex(df['date'].unique(), freq='M').sort_values()
+        tickers = pd.Index(df['Ticker'].unique())
+        rows, cols = months.get_indexer(df['date']), tickers.get_indexer(df['Ticker'])
+
+        mkt_cap = np.full((len(months), len(tickers)), np.nan)
+        mth_return = np.full((len(months), len(tickers)), np.nan)
+        mkt_cap[rows, cols] = df['MthCap'].to_numpy(dtype=float)
+        mth_return[rows, cols] = df['MthRetx'].to_numpy(dtype=float)
+        _monthly_panels['sp500'] = (months, tickers, mkt_cap, mth_return)
+    return _monthly_panels['sp500']
+
+@profiled
+def mcap_arrays(months, mask=None):
+    # caps and returns for the given months, optionally restricted to a month x ticker mask
+    all_months, tickers, mkt_cap, mth_return = monthly_panel()
+    rows = all_months.get_indexer(pd.PeriodIndex(months, freq='M'))
+    mkt_cap = np.where(rows[:, None] >= 0, mkt_cap[np.maximum(rows, 0)], np.nan)
+    mth_return = np.where(rows[:, None] >= 0, mth_return[np.maximum(rows, 0)], np.nan)
+    if mask is not None:
+        mkt_cap = np.where(mask, mkt_cap, np.nan)
+        mth_return = np.where(mask, mth_return, np.nan)
+    return tickers, mkt_cap, mth_return
+
+@profiled
+def mcap_weighted_returns(portfolio_tickers, months):
+    # month x portfolio cap weighted returns for portfolios held over the given months
+    tickers, mkt_cap, mth_return = mcap_arrays(months)
+    assignment = np.zeros((len(tickers), len(portfolio_tickers)))
+    for i, portfolio in enumerate(portfolio_tickers):
+        cols = tickers.get_indexer(pd.Index(portfolio))
+        assignment[cols[cols >= 0], i] = 1
+
+    # weights are normalized over tickers with a cap; a missing return contributes nothing
+    total_cap = np.nan_to_num(mkt_cap) @ assignment
+    weighted = np.nan_to_num(mkt_cap * mth_return) @ assignment
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total_cap != 0, weighted / total_cap, 0.0)
+
+@profiled
 def mcap_dataframes(start='2018-01', end='2023-12', freq='M'):
-    df = process_csv()
     date_range = pd.period_range(start=start, end=end, freq=freq)
-
-    mkt_cap = pd.DataFrame(index=date_range)
-    mth_return = pd.DataFrame(index=date_range)
-    mcap_weights = pd.DataFrame(index=date_range)
-    mcap_weighted_return = pd.DataFrame(index=date_range)
-
-    for date in date_range:
-        tickers = largecap_tickers(date)
-        df_filtered = df[df['date'] == date]
-
-        for ticker in tickers:
-            ticker_data = df_filtered[df_filtered['Ticker'] == ticker]
-            if not ticker_data.empty:
-                mkt_cap.at[date, ticker] = ticker_data['MthCap'].values[0]
-                mth_return.at[date, ticker] = ticker_data['MthRetx'].values[0]
-
-        if date in mkt_cap.index:
-            total_market_cap = mkt_cap.loc[date].sum()
-            if total_market_cap != 0:
-                for ticker in tickers:
-                    if ticker in mkt_cap.columns:
-                        mcap_weights.at[date, ticker] = mkt_cap.at[date, ticker] / total_market_cap
-
-        if date in mcap_weights.index:
-            row_sum = mcap_weights.loc[date].sum()
-            if row_sum != 0:
-                mcap_weights.loc[date, 'SumOfWeights'] = row_sum
-                mcap_weights.loc[date] = mcap_weights.loc[date] / row_sum
-
-    mcap_weighted_return = mth_return * mcap_weights
-    portfolio_return = mcap_weighted_return.sum(axis=1)
-    mcap_index = pd.DataFrame({'date': date_range.astype(str), 'return': portfolio_return})
-
-    mkt_cap['n'] = mkt_cap.notna().sum(axis=1)
-    mth_return['n'] = mth_return.notna().sum(axis=1)
-    mcap_weights['n'] = mcap_weights.notna().sum(axis=1)
-    mcap_weighted_return['n'] = mcap_weighted_return.notna().sum(axis=1)
-    mcap_index['n'] = mcap_weighted_return['n']
+    tickers = monthly_panel()[1]
+    mask = membership_mask(date_range.start_time, 'sp500', tickers)
+    tickers, mkt_cap, mth_return = mcap_arrays(date_range, mask)
+
+    # weights sum to 1 over the constituents with a market cap each month
+    total_cap = np.nansum(mkt_cap, axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = np.where(total_cap != 0, mkt_cap / total_cap, np.nan)
+    weighted_return = mth_return * weights
+
+    held = mask.any(axis=0)
+    mkt_cap = pd.DataFrame(mkt_cap[:, held], index=date_range, columns=tickers[held])
+    mth_return = pd.DataFrame(mth_return[:, held], index=date_range, columns=tickers[held])
+    mcap_weights = pd.DataFrame(weights[:, held], index=date_range, columns=tickers[held])
+    mcap_weighted_return = pd.DataFrame(weighted_return[:, held], index=date_range, columns=tickers[held])
+    mcap_index = pd.DataFrame({'date': date_range.astype(str), 'return': mcap_weighted_return.sum(axis=1)})
 
     # equal weight index
-    mth_return['EqualWeightReturn'] = mth_return.apply(lambda row: row.dropna().mean(), axis=1)
-    eqw_index = pd.DataFrame({'date': date_range.astype(str), 'return': mth_return['EqualWeightReturn'] - 1})
-    eqw_index['n'] = mcap_weighted_return['n']
+    eqw_index = pd.DataFrame({'date': date_range.astype(str), 'return': mth_return.mean(axis=1)})
 
-    # check if weights sum to 1
-    # print(f"All weights sum to 1: {all(abs(mcap_weights['SumOfWeights'] - 1) < 1e-6)}")
+    for df in (mkt_cap, mth_return, mcap_weights, mcap_weighted_return):
+        df['n'] = df.notna().sum(axis=1)
+    mcap_index['n'] = mcap_weighted_return['n']
+    eqw_index['n'] = mcap_weighted_return['n']
 
     return mkt_cap, mth_return, mcap_weights, mcap_weighted_return, mcap_index, eqw_index
 
+_largecap_indexes = {}
+
+@profiled
+def largecap_index(start='2018-01', end='2023-12', freq='M'):
+    # (market cap weighted index, equal weighted index), built once per range
+    key = (str(start), str(end), freq)
+    if key not in _largecap_indexes:
+        _, _, _, _, mcap_index, eqw_index = mcap_dataframes(start, end, freq)
+        _largecap_indexes[key] = (mcap_index, eqw_index)
+
+    mcap_index, eqw_index = _largecap_indexes[key]
+    return mcap_index.copy(), eqw_index.copy()
+
 def plot_return(final_df, equal_weight=False):
+    import matplotlib.pyplot as plt
+
     start_date = '2018-01-01'
     end_date = '2023-12-31'
 
     if equal_weight:
-        sp500 = yf.download('^SPXEW', start=start_date, end=end_date, interval='1mo', progress=False)
+        sp500 = benchmark_prices('^SPXEW', start_date, end_date, interval='monthly').to_frame('Adj Close')
     else:
-        sp500 = yf.download('^SPX', start=start_date, end=end_date, interval='1mo', progress=False)
+        sp500 = benchmark_prices('^SPX', start_date, end_date, interval='monthly').to_frame('Adj Close')
 
     sp500['Return'] = sp500['Adj Close'].pct_change()
     sp500['CumulativeReturn'] = (1 + sp500['Return']).cumprod()
@@ -112,10 +149,11 @@ def plot_return(final_df, equal_weight=False):
     plt.grid(True)
     plt.show()
 
-pd.set_option('display.max_rows', None)
-pd.set_option('display.max_columns', None)
+if __name__ == "__main__":
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.max_columns', None)
 
-_, _, _, _, mcap_index, eqw_index = mcap_dataframes(freq='M')
+    mcap_index, eqw_index = largecap_index()
 
-plot_return(eqw_index, equal_weight=True)
-plot_return(mcap_index, equal_weight=False)
+    plot_return(eqw_index, equal_weight=True)
+    plot_return(mcap_index, equal_weight=False)
@@ -10,6 +10,8 @@ index = 'nasdaq100'
 
 market_cap_weight = False
 rebalance_frequency = 'yearly'
+buckets = 5             # 3 for terciles, 10 for deciles, 20 for ventiles
+long_short = False      # add a top minus bottom portfolio
 plot_granularity = 'quarterly'
 """
 available metrics for portfolio construction:
@@ -86,8 +88,9 @@ available metrics for portfolio construction:
 """
 
 portfolios, portfolio_stats = rebalanced_portfolio(metric, index=index, start_date=start_date, end_date=end_date,
-                                                   frequency=rebalance_frequency, mcap=market_cap_weight)
+                                                   frequency=rebalance_frequency, mcap=market_cap_weight,
+                                                   buckets=buckets, long_short=long_short)
 print_portfolio_stats(portfolio_stats)
-portfolio_analysis(portfolio_stats, metric, index)
+portfolio_analysis(portfolio_stats, metric, index, buckets=buckets, long_short=long_short)
 plot_portfolio_returns(portfolios, start_date=start_date, end_date=end_date,
-                       granularity=plot_granularity, index=index, metric=metric)
+                       granularity=plot_granularity, index=index, metric=metric, buckets=buckets, long_short=long_short)
@@ -0,0 +1,39 @@
+#-----------------[outliers]-----------------#
+#                                            #
+#   IQR filter / mask / winsorize & z-score  #
+#   clip over many columns in one pass       #
+#                                            #
+#--------------------------------------------#
+
+def outlier_columns(df):
+    return [col for col in df.select_dtypes('number').columns if col not in ('Ticker', 'TICKER', 'gvkey', 'permno')]
+
+def iqr_bounds(df, columns, threshold=2):
+    quartiles = df[columns].quantile([0.25, 0.75])
+    iqr = quartiles.loc[0.75] - quartiles.loc[0.25]
+    return quartiles.loc[0.25] - threshold * iqr, quartiles.loc[0.75] + threshold * iqr
+
+def remove_outliers(df, threshold=2, method='filter', columns=None):
+    # filter: drop rows outside the IQR bounds in any column    mask: set those values to NaN
+    # winsorize: clip to the IQR bounds    zscore: clip to mean +/- threshold standard deviations
+    columns = outlier_columns(df) if columns is None else list(columns)
+    values = df[columns]
+
+    if method == 'zscore':
+        mean, std = values.mean(), values.std()
+        lower, upper = mean - threshold * std, mean + threshold * std
+    elif method in ('filter', 'mask', 'winsorize'):
+        lower, upper = iqr_bounds(df, columns, threshold)
+    else:
+        raise ValueError("Invalid method. Choose from 'filter', 'mask', 'winsorize', or 'zscore'.")
+
+    if method == 'filter':
+        outside = values.lt(lower, axis=1) | values.gt(upper, axis=1)
+        return df[~outside.any(axis=1)]
+
+    df = df.copy()
+    if method == 'mask':
+        df[columns] = values.where(values.ge(lower, axis=1) & values.le(upper, axis=1) | values.isna())
+    else:
+        df[columns] = values.clip(lower, upper, axis=1)
+    return df
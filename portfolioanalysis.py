@@ -1,8 +1,8 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
+
+from indexdata import yearly_returns
+from backtest import portfolio_labels
 
 def index_return(index, start_date, end_date):
     if index == 'nasdaq100':
@@ -10,34 +10,11 @@ def index_return(index, start_date, end_date):
     else:
         ticker = '^GSPC'
 
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-    yearly_returns = []
-    current_date = start_date
-
-    while current_date < end_date:
-        next_year_date = current_date + pd.DateOffset(years=1)
-        index_data = yf.download(ticker, start=current_date, end=next_year_date)
-
-        if not index_data.empty:
-            start_price = index_data['Adj Close'].iloc[0]
-            end_price = index_data['Adj Close'].iloc[-1]
-            period_return = (end_price / start_price) - 1
-
-            yearly_returns.append({
-                'Year': current_date.year,
-                'Period Return': period_return
-            })
-
-        current_date = next_year_date
+    return yearly_returns(ticker, start_date, end_date)
 
-    yearly_returns_df = pd.DataFrame(yearly_returns)
-    yearly_returns_df.set_index('Year', inplace=True)
-
-    return yearly_returns_df
-
-def portfolio_analysis(portfolio_stats, metric, index):
-    portfolio_categories = ['<=0', 'Q1', 'Q2', 'Q3', 'Q4', 'Q5', index.upper()]
+def analysis_tables(portfolio_stats, index, buckets=5, long_short=False):
+    # (CAGR per portfolio, portfolio x year table of period returns) with the index as the last row
+    portfolio_categories = portfolio_labels(buckets, long_short) + [index.upper()]
 
     all_data = []
     for portfolio, stats_list in portfolio_stats.items():
@@ -74,16 +51,31 @@ def portfolio_analysis(portfolio_stats, metric, index):
     cagr_df['Portfolio'] = pd.Categorical(cagr_df['Portfolio'], categories=portfolio_categories, ordered=True)
     cagr_df = cagr_df.sort_values('Portfolio')
 
-    print("*-------------------------------*")
-    print(cagr_df.to_string(index=False))
-    print("*-------------------------------*")
-
     heatmap_data = portfolio_df.pivot_table(index='Portfolio', columns='Year', values='Period Return', aggfunc='sum')
     heatmap_data = heatmap_data.reindex(portfolio_categories)
+    return cagr_df, heatmap_data
+
+def plot_annual_returns(heatmap_data, metric, path=None):
+    # shows the heatmap, or saves it to path (the extension picks the format) without opening a window
+    import seaborn as sns
+    import matplotlib.pyplot as plt
 
-    plt.figure(figsize=(12, 8))
+    fig = plt.figure(figsize=(12, 8))
     sns.heatmap(heatmap_data, annot=True, fmt=".2%", cmap='RdYlGn', center=0, cbar_kws={'format': '%.0f%%'},
                 annot_kws={"size": 8, "rotation": 90})
     plt.title(f'Annual Returns by {metric}')
     plt.xticks(rotation=90)
-    plt.show()
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, bbox_inches='tight')
+        plt.close(fig)
+
+def portfolio_analysis(portfolio_stats, metric, index, path=None, buckets=5, long_short=False):
+    cagr_df, heatmap_data = analysis_tables(portfolio_stats, index, buckets, long_short)
+
+    print("*-------------------------------*")
+    print(cagr_df.to_string(index=False))
+    print("*-------------------------------*")
+
+    plot_annual_returns(heatmap_data, metric, path)
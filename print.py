@@ -1,17 +1,18 @@
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from datetime import datetime
 
-import matplotlib.colors as mcolors
-import matplotlib.pyplot as plt
+from largecapindex import largecap_index
+from indexdata import benchmark_prices
+from backtest import portfolio_labels
 
-from largecapindex import mcap_dataframes
+def plot_portfolio_returns(daily_returns_list, start_date, end_date, granularity, index, metric, path=None, buckets=5,
+                           long_short=False):
+    # shows the chart, or saves it to path (the extension picks the format) without opening a window
+    import matplotlib.pyplot as plt
 
-def plot_portfolio_returns(daily_returns_list, start_date, end_date, granularity, index, metric):
-
-    portfolio_names = ['Less than or equal to 0', 'Quintile 1', 'Quintile 2', 'Quintile 3', 'Quintile 4', 'Quintile 5']
-    num_portfolios = len(daily_returns_list)
+    portfolio_names = portfolio_labels(buckets, long_short, verbose=True)
+    num_portfolios = buckets + 1
     colors = plt.cm.Blues(np.linspace(0.3, 1, num_portfolios))  # Generate shades of blue
 
     if index == 'nasdaq100':
@@ -22,27 +23,32 @@ def plot_portfolio_returns(daily_returns_list, start_date, end_date, granularity
         i = '^SPX'
 
     if granularity == 'daily':
-        index_return = yf.download(i, start=start_date, end=end_date)
+        index_return = benchmark_prices(i, start_date, end_date).to_frame('Adj Close')
     else:
-        index_return = yf.download(i, start=start_date, end=end_date, interval='1mo')
+        index_return = benchmark_prices(i, start_date, end_date, interval='monthly').to_frame('Adj Close')
 
     index_return['Return'] = index_return['Adj Close'].pct_change()
     index_return['Cumulative Return'] = (1 + index_return['Return']).cumprod()
 
-    plt.figure(figsize=(12, 8))
+    fig = plt.figure(figsize=(12, 8))
 
     for i, daily_returns_df in enumerate(daily_returns_list):
         if daily_returns_df.empty:
             continue
         daily_returns_df = resample_data(daily_returns_df, granularity)
         daily_returns_df['Cumulative Return'] = (1 + daily_returns_df['Return']).cumprod()
-        plt.plot(daily_returns_df['Date'], daily_returns_df['Cumulative Return'], label=portfolio_names[i], color=colors[i])
+        if i < num_portfolios:
+            plt.plot(daily_returns_df['Date'], daily_returns_df['Cumulative Return'], label=portfolio_names[i], color=colors[i])
+        else:
+            # top minus bottom
+            plt.plot(daily_returns_df['Date'], daily_returns_df['Cumulative Return'], label=portfolio_names[i],
+                     linestyle=':', color='green')
 
     # plot calculated large cap index
     if index == 'sp500':
         start = (datetime.strptime(start_date, '%Y-%m-%d')).strftime('%Y-%m')
         end = (datetime.strptime(end_date, '%Y-%m-%d')).strftime('%Y-%m')
-        _, _, _, _, mcap_index, _, = mcap_dataframes(start, end)
+        mcap_index, _ = largecap_index(start, end)
 
         mcap_index['date'] = pd.to_datetime(mcap_index['date'])
         mcap_index.set_index('date', inplace=True)
@@ -56,7 +62,11 @@ def plot_portfolio_returns(daily_returns_list, start_date, end_date, granularity
     plt.title(f'Portfolios by {get_metric_description(metric)} (Cumulative Returns) from {start_date} to {end_date}')
     plt.legend()
     plt.grid(True)
-    plt.show()
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, bbox_inches='tight')
+        plt.close(fig)
 
 def print_portfolio_stats(portfolio_stats):
     for i, stats in portfolio_stats.items():
@@ -69,9 +79,9 @@ def resample_data(df, granularity):
     df = df.set_index('Date')
 
     if granularity == 'quarterly':
-        df_resampled = df.resample('Q').agg({'Return': lambda x: (1 + x).prod() - 1})
+        df_resampled = df.resample('QE').agg({'Return': lambda x: (1 + x).prod() - 1})
     elif granularity == 'yearly':
-        df_resampled = df.resample('Y').agg({'Return': lambda x: (1 + x).prod() - 1})
+        df_resampled = df.resample('YE').agg({'Return': lambda x: (1 + x).prod() - 1})
     else:  # default to daily
         df_resampled = df
 
@@ -150,4 +160,7 @@ def get_metric_description(metric_key):
         'adv_sale': 'Advertising Expenses/Sales',
         'staff_sale': 'Labor Expenses/Sales',
     }
+    if isinstance(metric_key, dict):
+        # composite score, e.g. {'bm': 1, 'roe': 1, 'de_ratio': -1} -> 'Composite of +1 bm, +1 roe, -1 de_ratio'
+        return 'Composite of ' + ', '.join(f'{weight:+g} {key}' for key, weight in metric_key.items())
     return metrics.get(metric_key, "Metric key not found")
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import runpy
+import argparse
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+#-----------------[profiling]----------------#
+#                                            #
+#   opt-in wall time, call counts & peak     #
+#   memory per stage and rebalance period,   #
+#   summarised or saved as a Chrome trace    #
+#                                            #
+#--------------------------------------------#
+
+# PORTFOLIO_PROFILE=1 turns it on at import, or call enable(); stages cost one flag check while off
+enabled = os.environ.get('PORTFOLIO_PROFILE', '0') != '0'
+track_memory = enabled and os.environ.get('PORTFOLIO_PROFILE_MEMORY', '1') != '0'
+
+_stats = {}     # (stage, period) -> [calls, wall seconds, peak bytes]
+_events = []    # Chrome trace 'complete' events
+_stack = []     # open stages: [memory at entry, highest peak seen by children]
+_period = None
+_origin = time.perf_counter()
+
+def enable(memory=True):
+    global enabled, track_memory
+    enabled = True
+    track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def reset():
+    global _period
+    _stats.clear()
+    _events.clear()
+    _stack.clear()
+    _period = None
+
+@contextmanager
+def period(label):
+    # tags every stage opened inside with a rebalance period, e.g. '2010-06-30'
+    global _period
+    previous, _period = _period, str(label)
+    try:
+        yield
+    finally:
+        _period = previous
+
+@contextmanager
+def stage(name):
+    if not enabled:
+        yield
+        return
+
+    memory = track_memory and tracemalloc.is_tracing()
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1][1] = max(_stack[-1][1], peak)
+        tracemalloc.reset_peak()
+    else:
+        current = 0
+    _stack.append([current, 0])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        entry_memory, child_peak = _stack.pop()
+        peak_bytes = 0
+        if memory:
+            peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+            peak_bytes = peak - entry_memory
+            if _stack:
+                _stack[-1][1] = max(_stack[-1][1], peak)
+
+        stats = _stats.setdefault((name, _period), [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += wall
+        stats[2] = max(stats[2], peak_bytes)
+
+        args = {'period': _period} if _period is not None else {}
+        if memory:
+            args['peak_mb'] = round(peak_bytes / 1024 ** 2, 3)
+        _events.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': os.getpid(),
+                        'tid': threading.get_ident(), 'ts': (start - _origin) * 1e6, 'dur': wall * 1e6,
+                        'args': args})
+
+def profiled(func=None, name=None):
+    if func is None:
+        return functools.partial(profiled, name=name)
+    name = name or f'{func.__module__}.{func.__name__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        with stage(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+def summary(by_period=False):
+    rows = [{'Stage': name, 'Period': label, 'Calls': calls, 'Total (s)': wall, 'Peak (MB)': peak / 1024 ** 2}
+            for (name, label), (calls, wall, peak) in _stats.items()]
+    df = pd.DataFrame(rows, columns=['Stage', 'Period', 'Calls', 'Total (s)', 'Peak (MB)'])
+    if not by_period:
+        df = df.groupby('Stage', as_index=False).agg({'Calls': 'sum', 'Total (s)': 'sum', 'Peak (MB)': 'max'})
+    df['Mean (ms)'] = 1000 * df['Total (s)'] / df['Calls']
+    return df.sort_values(by='Total (s)', ascending=False).reset_index(drop=True)
+
+def save_trace(path='trace.json'):
+    # open in chrome://tracing or https://ui.perfetto.dev
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms'}, f)
+    return path
+
+if enabled and track_memory:
+    tracemalloc.start()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a script with per-stage profiling enabled.')
+    parser.add_argument('script')
+    parser.add_argument('--trace', default='trace.json')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, which slows allocation heavy code')
+    parser.add_argument('--by-period', action='store_true')
+    args, script_args = parser.parse_known_args()
+
+    # the instrumented modules import 'profiling', not this __main__ copy
+    import profiling as profiler
+
+    os.environ['PORTFOLIO_CACHE'] = '0'
+    profiler.enable(memory=not args.no_memory)
+    sys.argv = [args.script] + script_args
+    try:
+        runpy.run_path(args.script, run_name='__main__')
+    finally:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(profiler.summary(by_period=args.by_period).round(3).to_string(index=False))
+        print(f"Trace written to {profiler.save_trace(args.trace)}")
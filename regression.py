@@ -1,42 +1,40 @@
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy import stats
 import statsmodels.api as sm
 
-from datapipeline import price, historical_data
+from datapipeline import historical_data, historical_snapshots, prices_asof, last_prices, metrics as available_metrics
+from backtest import rebalance_dates, period_end
 from print import get_metric_description
+from outliers import remove_outliers
 
-def metric_and_return_df(index, metrics, start_date, end_date):
+def metric_and_return_df(index, metrics, start_date, end_date, dropna=True):
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
     metrics_data = historical_data(start_date, index)
-    results = []
 
     if isinstance(metrics, str):
         metrics = [metrics]
 
-    for ticker in metrics_data['TICKER'].unique():
-        metric_values = {'Ticker': ticker}
-        for metric in metrics:
-            metric_value = metrics_data[metrics_data['TICKER'] == ticker][metric].values[0]
-            metric_values[metric] = metric_value
+    # ticker x metric matrix from the snapshot, the start price as of start_date & the last price in the window
+    results_df = metrics_data.drop_duplicates(subset='TICKER')[['TICKER'] + list(metrics)]
+    results_df = results_df.rename(columns={'TICKER': 'Ticker'}).reset_index(drop=True)
+    start_price = prices_asof(results_df['Ticker'], [start_date], index)[0]
+    end_price = last_prices(results_df['Ticker'], start_date, end_date, index)
+    results_df['Return'] = end_price / start_price - 1
 
-        price_data = price(ticker, start_date, end_date, index)
-        if price_data is not None:
-            start_price = price_data.loc[price_data.index[price_data.index <= start_date].max(), 'prccd']
-            end_price = price_data.loc[price_data.index[price_data.index <= end_date].max(), 'prccd']
-
-            stock_return = (end_price / start_price) - 1
-            metric_values['Return'] = stock_return
-            results.append(metric_values)
-
-    results_df = pd.DataFrame(results).dropna()
+    results_df = results_df.dropna() if dropna else results_df.dropna(subset=['Return'])
     return results_df
 
-def regression(index, metrics, start_date, end_date):
+def regression(index, metrics, start_date, end_date, outliers=None):
+    metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+
     df = metric_and_return_df(index, metrics, start_date, end_date)
-    # df = remove_outliers(df)
+    if outliers is not None:
+        df = remove_outliers(df, method=outliers, columns=metrics + ['Return'])
 
     X = sm.add_constant(df[metrics])
     y = df['Return']
@@ -47,9 +45,10 @@ def regression(index, metrics, start_date, end_date):
     print(results.summary())
     return df
 
-def plot_metric_return(df, metric):
-    # df_filtered = remove_outliers(df)
-    plt.figure(figsize=(12, 6))
+def plot_metric_return(df, metric, outliers=None, path=None):
+    if outliers is not None:
+        df = remove_outliers(df, method=outliers, columns=[metric, 'Return'])
+    fig = plt.figure(figsize=(12, 6))
     sns.scatterplot(x=metric, y='Return', data=df)
 
     X = sm.add_constant(df[metric])
@@ -64,58 +63,117 @@ def plot_metric_return(df, metric):
     plt.title(f'{get_metric_description(metric)} vs. return')
     plt.legend()
     plt.grid(True)
-    plt.show()
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, bbox_inches='tight')
+        plt.close(fig)
 
     print(results.summary())
 
-def all_metrics_regression(index, start_date, end_date):
-    results_list = []
-    metrics = ['CAPEI', 'bm', 'evm', 'pe_op_basic', 'pe_op_dil', 'pe_exi', 'pe_inc', 'ps', 'pcf', 'dpr', 'npm',
-               'opmbd', 'opmad', 'gpm', 'ptpm', 'cfm', 'roa', 'roe', 'roce', 'efftax', 'aftret_eq', 'aftret_invcapx',
-               'aftret_equity', 'pretret_noa', 'pretret_earnat', 'GProf', 'equity_invcap', 'debt_invcap',
-               'totdebt_invcap', 'capital_ratio', 'int_debt', 'int_totdebt', 'cash_lt', 'invt_act', 'rect_act',
-               'debt_at', 'debt_ebitda', 'short_debt', 'curr_debt', 'lt_debt', 'profit_lct', 'ocf_lct', 'cash_debt',
-               'fcf_ocf', 'lt_ppent', 'dltt_be', 'debt_assets', 'debt_capital', 'de_ratio', 'intcov', 'intcov_ratio',
-               'cash_ratio', 'quick_ratio', 'curr_ratio', 'cash_conversion', 'inv_turn', 'at_turn', 'rect_turn',
-               'pay_turn', 'sale_invcap', 'sale_equity', 'sale_nwc', 'rd_sale', 'adv_sale', 'staff_sale', 'accrual',
-               'ptb', 'PEG_trailing']
-    
-    df = metric_and_return_df(index, metric, start_date, end_date)
-    for metric in metrics:
-        print(metric)
-        # df = remove_outliers(df)
-
-        if df.empty:
-            continue
-
-        X = sm.add_constant(df[metric])
-        y = df['Return']
-        model = sm.OLS(y, X)
-        results = model.fit()
-
-        results_list.append({'Metric': metric, 'P-Value': results.pvalues[metric],
-                             'R-Squared': results.rsquared, 'Coefficient': results.params[metric],
-                             'n': results.nobs})
-
-    results_df = pd.DataFrame(results_list)
+def batch_ols(df, metrics, target='Return'):
+    # univariate OLS of target on each metric in one pass, dropping NaNs per column
+    X = df[list(metrics)].to_numpy(dtype=float)
+    y = df[target].to_numpy(dtype=float)[:, None]
+    valid = ~np.isnan(X) & ~np.isnan(y)
+    n = valid.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.where(valid, X, 0).sum(axis=0) / n
+        mean_y = np.where(valid, y, 0).sum(axis=0) / n
+        dx = np.where(valid, X - mean_x, 0)
+        dy = np.where(valid, y - mean_y, 0)
+        sxx, syy, sxy = (dx * dx).sum(axis=0), (dy * dy).sum(axis=0), (dx * dy).sum(axis=0)
+
+        slope = sxy / sxx
+        intercept = mean_y - slope * mean_x
+        r_squared = sxy ** 2 / (sxx * syy)
+        dof = n - 2
+        std_err = np.sqrt(np.maximum(syy - slope * sxy, 0) / dof / sxx)
+        t_stat = slope / std_err
+    p_value = 2 * stats.t.sf(np.abs(t_stat), np.where(dof > 0, dof, np.nan))
+
+    return pd.DataFrame({'Metric': list(metrics), 'P-Value': p_value, 'R-Squared': r_squared,
+                         'Coefficient': slope, 'Intercept': intercept, 'T-Stat': t_stat, 'n': n})
+
+def all_metrics_regression(index, start_date, end_date, outliers=None):
+    metrics = list(available_metrics)
+
+    df = metric_and_return_df(index, metrics, start_date, end_date, dropna=False)
+    if outliers == 'filter':
+        # each regression only sees its own column, so mask outliers instead of dropping whole rows
+        outliers = 'mask'
+    if outliers is not None:
+        df = remove_outliers(df, method=outliers, columns=metrics + ['Return'])
+    if df.empty:
+        return pd.DataFrame(columns=['Metric', 'P-Value', 'R-Squared', 'Coefficient', 'Intercept', 'T-Stat', 'n'])
+
+    results_df = batch_ols(df, metrics)
     results_df = results_df.sort_values(by='R-Squared', ascending=False)
 
     return results_df
 
-def remove_outliers(df, threshold=2):
-    df_filtered = pd.DataFrame()
-    for col in df.columns:
-        if col == 'Ticker':
-            continue
-        q1 = df[col].quantile(0.25)
-        q3 = df[col].quantile(0.75)
-        iqr = q3 - q1
-        lower_bound = q1 - threshold * iqr
-        upper_bound = q3 + threshold * iqr
-        filtered_rows = df[(df[col] >= lower_bound) & (df[col] <= upper_bound)]
-        df_filtered = pd.concat([df_filtered, filtered_rows], ignore_index=True)
-
-    return df_filtered
+#---------------[fama_macbeth]---------------#
+#                                            #
+#   cross-sectional regressions at every     #
+#   rebalance date, averaged with Newey-West #
+#              standard errors               #
+#                                            #
+#--------------------------------------------#
+
+def cross_section_ols(problem):
+    X, y = problem
+    valid = ~np.isnan(X).any(axis=1) & ~np.isnan(y)
+    if valid.sum() <= X.shape[1] + 1:
+        return np.full(X.shape[1] + 1, np.nan)
+
+    A = np.column_stack([np.ones(valid.sum()), X[valid]])
+    coefficients, _, _, _ = np.linalg.lstsq(A, y[valid], rcond=None)
+    return coefficients
+
+def newey_west_se(series, lags):
+    u = series - series.mean()
+    T = len(u)
+    variance = u @ u / T
+    for lag in range(1, min(lags, T - 1) + 1):
+        variance += 2 * (1 - lag / (lags + 1)) * (u[lag:] @ u[:-lag]) / T
+    return np.sqrt(variance / T)
+
+def fama_macbeth(index, metrics, start_date, end_date, frequency='monthly', lags=None, processes=None):
+    if isinstance(metrics, str):
+        metrics = [metrics]
+
+    # snapshots for every date in one lookup; returns from the price panel over each period
+    dates = rebalance_dates(start_date, end_date, frequency)
+    snapshots = historical_snapshots(dates, index)
+    problems = []
+    for date in dates:
+        snapshot = snapshots[date]
+        # names that stop trading during the period keep their last price rather than leaving the cross-section
+        start_price = prices_asof(snapshot['TICKER'], [date], index)[0]
+        end_price = last_prices(snapshot['TICKER'], date, period_end(date, frequency), index)
+        problems.append((snapshot[metrics].to_numpy(dtype=float), end_price / start_price - 1))
+
+    if processes == 1:
+        coefficients = [cross_section_ols(problem) for problem in problems]
+    else:
+        with mp.Pool(processes) as pool:
+            coefficients = pool.map(cross_section_ols, problems, chunksize=max(1, len(problems) // 64))
+
+    names = ['const'] + list(metrics)
+    series = pd.DataFrame(coefficients, index=pd.DatetimeIndex(dates, name='Date'), columns=names).dropna()
+    T = len(series)
+    if lags is None:
+        lags = int(np.floor(4 * (T / 100) ** (2 / 9)))
+
+    std_err = np.array([newey_west_se(series[name].to_numpy(), lags) if T > 1 else np.nan for name in names])
+    coefficient = series.mean().to_numpy()
+    t_stat = coefficient / std_err
+    p_value = 2 * stats.t.sf(np.abs(t_stat), max(T - 1, 1))
+
+    summary = pd.DataFrame({'Coefficient': coefficient, 'NW Std Err': std_err, 'T-Stat': t_stat,
+                            'P-Value': p_value, 'Periods': T}, index=names)
+    return summary, series
 
 if __name__ == "__main__":
     metric = 'npm'
@@ -0,0 +1,119 @@
+import os
+import argparse
+from itertools import product
+
+import matplotlib
+matplotlib.use('Agg')  # render to files only, before anything imports pyplot
+
+import pandas as pd
+
+from backtest import rebalanced_portfolio, portfolio_labels, metrics as available_metrics
+from print import plot_portfolio_returns
+from portfolioanalysis import analysis_tables, plot_annual_returns
+from sweep import index_pool
+
+#------------------[report]------------------#
+#                                            #
+#   renders the return chart, annual return  #
+#  heatmap & CAGR table of each backtest to  #
+#  files on a pool of headless processes     #
+#                                            #
+#--------------------------------------------#
+
+class EmptyReport(ValueError):
+    pass
+
+def report_dir(out_dir, metric, index, frequency, weighting, buckets=5):
+    # quintile reports keep their original names
+    suffix = '' if buckets == 5 else f'_{buckets}tiles'
+    return os.path.join(out_dir, f'{index}_{metric}_{frequency}_{weighting}{suffix}')
+
+def render_report(metric, index, start_date='2003-01-01', end_date='2024-01-01', frequency='yearly', mcap=False,
+                  granularity='quarterly', out_dir='reports', formats=('png', 'svg'), buckets=5, long_short=False):
+    if mcap:
+        frequency = 'monthly'
+    path = report_dir(out_dir, metric, index, frequency, 'mcap' if mcap else 'equal', buckets)
+    os.makedirs(path, exist_ok=True)
+
+    portfolios, portfolio_stats = rebalanced_portfolio(metric, index=index, start_date=start_date, end_date=end_date,
+                                                       frequency=frequency, mcap=mcap, buckets=buckets,
+                                                       long_short=long_short)
+    if not any(portfolio_stats.values()):
+        raise EmptyReport(f"No portfolios formed for {metric} in {index}.")
+
+    portfolio_names = portfolio_labels(buckets, long_short)
+    daily_returns = pd.concat([df.assign(Portfolio=portfolio_names[i]) for i, df in enumerate(portfolios)])
+    daily_returns.to_csv(os.path.join(path, 'daily_returns.csv'), index=False)
+    stats = pd.DataFrame([{'Portfolio': portfolio_names[i], **s} for i, stats_list in portfolio_stats.items()
+                          for s in stats_list]).drop(columns='Tickers')
+    stats.to_csv(os.path.join(path, 'period_stats.csv'), index=False)
+
+    cagr_df, heatmap_data = analysis_tables(portfolio_stats, index, buckets, long_short)
+    cagr_df.to_csv(os.path.join(path, 'cagr.csv'), index=False)
+    heatmap_data.to_csv(os.path.join(path, 'annual_returns.csv'))
+
+    for fmt in formats:
+        plot_portfolio_returns(portfolios, start_date=start_date, end_date=end_date, granularity=granularity,
+                               index=index, metric=metric, path=os.path.join(path, f'cumulative_returns.{fmt}'),
+                               buckets=buckets, long_short=long_short)
+        plot_annual_returns(heatmap_data, metric, path=os.path.join(path, f'annual_returns.{fmt}'))
+    return path
+
+def _render(config):
+    (metric, index, frequency, weighting, start_date, end_date, granularity, out_dir, formats, buckets,
+     long_short) = config
+    try:
+        return render_report(metric, index, start_date, end_date, frequency, weighting == 'mcap', granularity,
+                             out_dir, formats, buckets, long_short)
+    except EmptyReport as e:
+        print(f"Skipping {metric} / {index} / {frequency} / {weighting}: {e}")
+        return None
+
+def render_reports(metrics, indices, frequencies=('yearly',), weightings=('equal',), start_date='2003-01-01',
+                   end_date='2024-01-01', granularity='quarterly', out_dir='reports', formats=('png', 'svg'),
+                   processes=None, buckets=5, long_short=False):
+    configs = []
+    for metric, index, frequency, weighting in product(metrics, indices, frequencies, weightings):
+        if weighting == 'mcap':
+            frequency = 'monthly'
+        config = (metric, index, frequency, weighting, start_date, end_date, granularity, out_dir, tuple(formats),
+                  buckets, long_short)
+        if config not in configs:
+            configs.append(config)
+
+    with index_pool(indices, processes) as pool:
+        paths = [path for path in pool.imap_unordered(_render, configs, chunksize=1) if path is not None]
+
+    # one CAGR table across every configuration
+    frames = []
+    for path in sorted(paths):
+        cagr = pd.read_csv(os.path.join(path, 'cagr.csv'))
+        cagr.insert(0, 'Report', os.path.basename(path))
+        frames.append(cagr)
+    summary = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['Report', 'Portfolio', 'CAGR'])
+    os.makedirs(out_dir, exist_ok=True)
+    summary.to_csv(os.path.join(out_dir, 'cagr_summary.csv'), index=False)
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render backtest reports to files for a grid of parameters.')
+    parser.add_argument('--metrics', nargs='+', default=['all'], help="metrics to report, or 'all'")
+    parser.add_argument('--indices', nargs='+', default=['nasdaq100'],
+                        choices=['nasdaq100', 'russell200', 'sp500'])
+    parser.add_argument('--frequencies', nargs='+', default=['yearly'],
+                        choices=['monthly', 'quarterly', 'yearly', 'daily', 'weekly', 'month_end', 'quarter_end'])
+    parser.add_argument('--weightings', nargs='+', default=['equal'], choices=['equal', 'mcap'])
+    parser.add_argument('--start', default='2003-01-01')
+    parser.add_argument('--end', default='2024-01-01')
+    parser.add_argument('--granularity', default='quarterly', choices=['daily', 'quarterly', 'yearly'])
+    parser.add_argument('--formats', nargs='+', default=['png', 'svg'])
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--buckets', type=int, default=5, help='N-tiles to split each ranking into')
+    parser.add_argument('--long-short', action='store_true', help='add a top minus bottom portfolio')
+    parser.add_argument('--out', default='reports')
+    args = parser.parse_args()
+
+    metrics = available_metrics if args.metrics == ['all'] else args.metrics
+    summary = render_reports(metrics, args.indices, args.frequencies, args.weightings, args.start, args.end,
+                             args.granularity, args.out, args.formats, args.processes, args.buckets, args.long_short)
+    print(f"{summary['Report'].nunique()} reports written to {args.out}")
@@ -0,0 +1,74 @@
+import re
+import numpy as np
+import pandas as pd
+
+from datapipeline import price_panel, membership, fundamentals_index, _day
+
+#-----------------[schedule]-----------------#
+#                                            #
+#   rebalance calendars aligned to trading   #
+#   days in the price panel, & the dates on  #
+#    which a ranking can actually change     #
+#                                            #
+#--------------------------------------------#
+
+# calendar frequencies: 'daily', 'weekly', 'month_end', 'quarter_end', every N trading days as an int or 'Nd',
+# or a list of dates; 'monthly', 'quarterly' and 'yearly' keep their fixed calendar offsets in backtest
+calendar_frequencies = {'daily': None, 'weekly': 'W', 'month_end': 'M', 'quarter_end': 'Q'}
+
+def is_calendar(frequency):
+    if isinstance(frequency, str):
+        return frequency in calendar_frequencies or re.fullmatch(r'\d+d', frequency) is not None
+    return isinstance(frequency, (int, np.integer)) or pd.api.types.is_list_like(frequency)
+
+def trading_days(index, start_date=None, end_date=None):
+    # trading dates in [start_date, end_date) from the index's price panel
+    days = pd.DatetimeIndex(price_panel(index)[0])
+    if start_date is not None:
+        days = days[days >= pd.to_datetime(start_date)]
+    if end_date is not None:
+        days = days[days < pd.to_datetime(end_date)]
+    return days
+
+def calendar_schedule(start_date, end_date, frequency, index):
+    # (rebalance dates, period ends): each period runs to the next rebalance, the last one to end_date
+    end_date = pd.to_datetime(end_date)
+    days = trading_days(index, start_date, end_date)
+
+    if isinstance(frequency, str) and frequency in calendar_frequencies:
+        if frequency == 'daily':
+            dates = days
+        else:
+            # last trading day of each week, month or quarter
+            periods = days.to_period(calendar_frequencies[frequency])
+            last = np.append(periods[1:] != periods[:-1], True) if len(days) else np.zeros(0, dtype=bool)
+            dates = days[last]
+    elif isinstance(frequency, (int, np.integer)) or (isinstance(frequency, str) and re.fullmatch(r'\d+d', frequency)):
+        step = int(frequency[:-1]) if isinstance(frequency, str) else int(frequency)
+        if step < 1:
+            raise ValueError("Rebalance every N trading days needs N >= 1.")
+        dates = days[::step]
+    elif not isinstance(frequency, str) and pd.api.types.is_list_like(frequency):
+        # custom dates move to the first trading day on or after them
+        custom = pd.to_datetime(pd.Index(frequency)).sort_values()
+        positions = np.searchsorted(days.values, custom.values, side='left')
+        dates = days[np.unique(positions[positions < len(days)])]
+    else:
+        raise ValueError("Invalid frequency. Choose 'monthly', 'quarterly', 'yearly', 'daily', 'weekly', "
+                         "'month_end', 'quarter_end', every N trading days, or a list of dates.")
+
+    dates = list(dates)
+    return dates, dates[1:] + [end_date] if dates else []
+
+def ranking_changes(dates, index):
+    # True where the constituents or any fundamentals published up to the date differ from the previous date,
+    # i.e. where rank_by can return something new; everything in between reuses the last ranking
+    dates = pd.to_datetime(pd.Index(dates))
+    snapshot_dates = membership(index)[0]
+    rows = np.searchsorted(snapshot_dates, dates.values, side='right') - 1
+    published = np.unique(fundamentals_index(index)[2] & 0xFFFFFFFF)
+    seen = np.searchsorted(published, _day(dates), side='right')
+
+    changed = np.ones(len(dates), dtype=bool)
+    changed[1:] = (rows[1:] != rows[:-1]) | (seen[1:] != seen[:-1])
+    return changed
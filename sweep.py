@@ -0,0 +1,105 @@
+import argparse
+import multiprocessing as mp
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from backtest import rebalanced_portfolio, portfolio_labels, metrics as available_metrics
+from datapipeline import fundamentals_index, membership, price_panel
+
+#-------------------[sweep]------------------#
+#                                            #
+#  runs rebalanced_portfolio for every mix   #
+#  of metric, index, frequency & weighting   #
+#           on a pool of processes           #
+#                                            #
+#--------------------------------------------#
+
+def load_index(index):
+    # price panels are memory-mapped, so forked workers share their pages
+    price_panel(index)
+    fundamentals_index(index)
+    membership(index)
+
+def _init_worker(indices):
+    for index in indices:
+        load_index(index)
+
+def index_pool(indices, processes=None):
+    # a process pool whose workers have the indices' panels & indexes loaded
+    if 'fork' in mp.get_all_start_methods():
+        # load once in the parent; forked workers inherit the arrays instead of unpickling copies
+        for index in indices:
+            load_index(index)
+        context = mp.get_context('fork')
+    else:
+        context = mp.get_context()
+    return context.Pool(processes, initializer=_init_worker, initargs=(list(indices),))
+
+def _run(config):
+    metric, index, frequency, weighting, start_date, end_date, buckets, long_short = config
+    _, portfolio_stats = rebalanced_portfolio(metric, index, start_date=start_date, end_date=end_date,
+                                              frequency=frequency, mcap=(weighting == 'mcap'), buckets=buckets,
+                                              long_short=long_short)
+
+    portfolio_names = portfolio_labels(buckets, long_short)
+    rows = []
+    for portfolio, stats_list in portfolio_stats.items():
+        for stats in stats_list:
+            rows.append({'Metric': metric, 'Index': index, 'Frequency': frequency, 'Weighting': weighting,
+                         'Portfolio': portfolio_names[portfolio], 'Year': stats['Year'], 'Month': stats['Month'],
+                         'Date': stats.get('Date'), 'Period Return': stats['Period Return']})
+    return rows
+
+def sweep(metrics, indices, frequencies=('yearly',), weightings=('equal',), start_date='2003-01-01',
+          end_date='2024-01-01', processes=None, buckets=5, long_short=False):
+    configs = []
+    for metric, index, frequency, weighting in product(metrics, indices, frequencies, weightings):
+        # market cap weighted portfolios are always rebalanced monthly
+        if weighting == 'mcap':
+            frequency = 'monthly'
+        config = (metric, index, frequency, weighting, start_date, end_date, buckets, long_short)
+        if config not in configs:
+            configs.append(config)
+
+    with index_pool(indices, processes) as pool:
+        rows = [row for result in pool.imap_unordered(_run, configs, chunksize=1) for row in result]
+
+    columns = ['Metric', 'Index', 'Frequency', 'Weighting', 'Portfolio', 'Year', 'Month', 'Date', 'Period Return']
+    results = pd.DataFrame(rows, columns=columns)
+    if results.empty:
+        results['CAGR'] = []
+        return results
+
+    group = results.groupby(['Metric', 'Index', 'Frequency', 'Weighting', 'Portfolio'])
+    years = group['Year'].transform('nunique')
+    growth = group['Period Return'].transform(lambda x: np.prod(1 + x))
+    results['CAGR'] = growth ** (1 / years) - 1
+    return results.sort_values(by=columns[:8]).reset_index(drop=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run backtests over a grid of parameters.')
+    parser.add_argument('--metrics', nargs='+', default=['all'], help="metrics to test, or 'all'")
+    parser.add_argument('--indices', nargs='+', default=['nasdaq100'],
+                        choices=['nasdaq100', 'russell200', 'sp500'])
+    parser.add_argument('--frequencies', nargs='+', default=['yearly'],
+                        choices=['monthly', 'quarterly', 'yearly', 'daily', 'weekly', 'month_end', 'quarter_end'])
+    parser.add_argument('--weightings', nargs='+', default=['equal'], choices=['equal', 'mcap'])
+    parser.add_argument('--start', default='2003-01-01')
+    parser.add_argument('--end', default='2024-01-01')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--buckets', type=int, default=5, help='N-tiles to split each ranking into')
+    parser.add_argument('--long-short', action='store_true', help='add a top minus bottom portfolio')
+    parser.add_argument('--output', default='sweep.csv')
+    args = parser.parse_args()
+
+    metrics = available_metrics if args.metrics == ['all'] else args.metrics
+    results = sweep(metrics, args.indices, args.frequencies, args.weightings, args.start, args.end,
+                    args.processes, args.buckets, args.long_short)
+    results.to_csv(args.output, index=False)
+
+    cagr = results.drop_duplicates(subset=['Metric', 'Index', 'Frequency', 'Weighting', 'Portfolio'])
+    print(cagr.pivot_table(index=['Metric', 'Index', 'Frequency', 'Weighting'], columns='Portfolio',
+                           values='CAGR').to_string())
+    print(f"Results written to {args.output}")
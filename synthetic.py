@@ -0,0 +1,124 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+#-----------------[synthetic]----------------#
+#                                            #
+#   CRSP & Compustat shaped test data with   #
+#   the same files & columns as the WRDS     #
+#   exports, at a configurable scale         #
+#                                            #
+#--------------------------------------------#
+
+index_sizes = {'nasdaq100': 100, 'russell200': 200, 'sp500': 500}
+
+def _universe(rng, tickers, size, dates):
+    # constituents drift over time: each date a few members are swapped out
+    size = min(size, len(tickers))
+    members = rng.choice(len(tickers), size, replace=False)
+    snapshots = []
+    for _ in dates:
+        swap = rng.random(size) < 0.02
+        outside = np.setdiff1d(np.arange(len(tickers)), members)
+        if len(outside):
+            members = members.copy()
+            members[swap] = rng.choice(outside, swap.sum(), replace=len(outside) < swap.sum())
+            members = np.unique(members)
+        snapshots.append(np.asarray(tickers)[members])
+    return snapshots
+
+def generate(out_dir, n_tickers=600, start_date='2000-01-01', end_date='2024-06-30', missing=0.01, seed=0):
+    from backtest import metrics  # imported here so PORTFOLIO_DATA_DIR can still be set by the caller
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    tickers = np.array([f'T{i:04d}' for i in range(n_tickers)])
+    gvkeys = np.array([f'{100000 + i:06d}' for i in range(n_tickers)])
+    days = pd.bdate_range(start_date, end_date)
+    months = pd.date_range(start_date, end_date, freq='ME')
+
+    # daily prices: geometric random walks with a few missing days
+    log_returns = rng.normal(0.0003, 0.02, (len(days), n_tickers))
+    prices = 20 * np.exp(np.cumsum(log_returns, axis=0))
+    prices[rng.random(prices.shape) < missing] = np.nan
+    price_df = pd.DataFrame({'gvkey': np.tile(gvkeys, len(days)), 'iid': '01',
+                             'datadate': np.repeat(days.strftime('%Y-%m-%d'), n_tickers),
+                             'tic': np.tile(tickers, len(days)), 'conm': np.tile(tickers, len(days)),
+                             'prccd': prices.ravel().round(4)}).dropna(subset=['prccd'])
+    for name in ('nasdaqprices', 'russell200prices', 'sp500prices'):
+        price_df.to_csv(os.path.join(out_dir, f'{name}.csv'), index=False)
+
+    # monthly fundamentals, published with a lag after the statement date
+    n_rows = len(months) * n_tickers
+    fundamentals = pd.DataFrame({'gvkey': np.tile(gvkeys, len(months)), 'permno': np.tile(np.arange(n_tickers), len(months)),
+                                 'adate': np.repeat((months - pd.DateOffset(months=6)).strftime('%Y-%m-%d'), n_tickers),
+                                 'qdate': np.repeat((months - pd.DateOffset(months=3)).strftime('%Y-%m-%d'), n_tickers),
+                                 'public_date': np.repeat(months.strftime('%Y-%m-%d'), n_tickers),
+                                 'TICKER': np.tile(tickers, len(months))})
+    values = rng.normal(1, 2, (n_rows, len(metrics))).round(4)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    fundamentals = pd.concat([fundamentals, pd.DataFrame(values, columns=metrics)], axis=1)
+    for name in ('nasdaq100historicaldata', 'russell200historicaldata', 'sp500historicaldata'):
+        fundamentals.to_csv(os.path.join(out_dir, f'{name}.csv'), index=False)
+
+    # monthly market caps & returns
+    mth_return = rng.normal(0.01, 0.06, (len(months), n_tickers)).round(6)
+    mth_cap = rng.lognormal(9, 1.5, (len(months), n_tickers)).round(2)
+    pd.DataFrame({'PERMNO': np.tile(np.arange(n_tickers), len(months)),
+                  'MthCalDt': np.repeat(months.strftime('%Y-%m-%d'), n_tickers),
+                  'Ticker': np.tile(tickers, len(months)), 'MthCap': mth_cap.ravel(),
+                  'MthRetx': mth_return.ravel()}).to_csv(os.path.join(out_dir, 'sp500monthlyreturn.csv'), index=False)
+
+    # NASDAQ 100: from/thru membership intervals
+    years = pd.date_range(start_date, end_date, freq='YS')
+    snapshots = _universe(rng, tickers, index_sizes['nasdaq100'], years)
+    rows = []
+    for i, (year, members) in enumerate(zip(years, snapshots)):
+        previous = set(snapshots[i - 1]) if i else set()
+        for ticker in set(members) - previous:
+            rows.append({'ticker': ticker, 'from': year})
+    nasdaq = pd.DataFrame(rows)
+    thru = []
+    for ticker, joined in zip(nasdaq['ticker'], nasdaq['from']):
+        later = [year for year, members in zip(years, snapshots) if year > joined and ticker not in members]
+        thru.append((later[0] - pd.Timedelta(days=1)).strftime('%Y-%m-%d') if later else '')
+    pd.DataFrame({'gvkey': gvkeys[np.searchsorted(tickers, nasdaq['ticker'])], 'iid': '01', 'gvkeyx': '000208',
+                  'from': nasdaq['from'].dt.strftime('%Y-%m-%d'), 'thru': thru, 'conm': 'Nasdaq 100',
+                  'indextype': 'LGCAP', 'tic': 'I0028', 'spii': '', 'spmi': '', 'indexcat': 'EXCHG',
+                  'co_conm': nasdaq['ticker'], 'co_tic': nasdaq['ticker'], 'co_cusip': '', 'co_cik': '',
+                  'co_sic': '', 'co_naics': ''}).to_csv(os.path.join(out_dir, 'nasdaqconstituents.csv'), index=False)
+
+    # Russell Top 200: quarterly snapshots with weights
+    quarters = pd.date_range(start_date, end_date, freq='QE')
+    snapshots = _universe(rng, tickers, index_sizes['russell200'], quarters)
+    russell = pd.DataFrame({'Date': np.repeat(quarters.strftime('%Y-%m-%d'), [len(s) for s in snapshots]),
+                            'Ticker': np.concatenate(snapshots), 'Russell1000': 'Y', 'RussellT200': 'Y'})
+    russell['R1000_WT'] = rng.dirichlet(np.ones(len(russell))).round(6)
+    russell['R200_WT'] = rng.dirichlet(np.ones(len(russell))).round(6)
+    russell.to_csv(os.path.join(out_dir, 'russell200constituents.csv'), index=False)
+
+    # S&P 500: monthly lists of tickers
+    snapshots = _universe(rng, tickers, index_sizes['sp500'], months)
+    pd.DataFrame({'date': months.strftime('%Y-%m'), 'tickers': [str([str(t) for t in s]) for s in snapshots]}) \
+        .to_csv(os.path.join(out_dir, 'sp500historicalconstituents.csv'), index=False)
+
+    # benchmark index closes
+    all_days = pd.bdate_range(pd.to_datetime(start_date) - pd.DateOffset(years=1), end_date)
+    benchmarks = []
+    for ticker in ('^NDX', '^SPX', '^RUT', '^SPXEW', '^IXIC', '^GSPC'):
+        closes = 1000 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, len(all_days))))
+        benchmarks.append(pd.DataFrame({'Date': all_days.strftime('%Y-%m-%d'), 'Ticker': ticker, 'Close': closes.round(2)}))
+    pd.concat(benchmarks).to_csv(os.path.join(out_dir, 'benchmarks.csv'), index=False)
+
+    return out_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write synthetic CRSP & Compustat shaped data files.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--tickers', type=int, default=600)
+    parser.add_argument('--start', default='2000-01-01')
+    parser.add_argument('--end', default='2024-06-30')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(f"Synthetic data written to {generate(args.out_dir, args.tickers, args.start, args.end, seed=args.seed)}")